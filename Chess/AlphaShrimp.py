@@ -2,12 +2,23 @@ import ChessEngine
 import math
 import numpy as np
 import copy
+import multiprocessing
+import time
+import Trace
+from Evaluator import NumpyEvaluator
+from Search import SearchResult
+
+MCTS_TRACE = Trace.MCTS
 
 def print_board(board):
     for row in board:
         print(' '.join(row))
     print()
 
+def board_rows(board):
+    # Board as 8 strings, how rollout trace events carry it
+    return [' '.join(row) for row in board]
+
 class Node:
     def __init__(self, gamestate, args, parent=None, action_taken=None):
         
@@ -18,7 +29,15 @@ class Node:
         self.action_taken = action_taken
 
         self.children = []
-        self.expandable_moves = copy.deepcopy(self.gamestate.getValidMoves())
+        if self.args.get('staged_expansion'):
+            # Pull moves from the staged generator one at a time (captures first),
+            # expandable_moves only holds the next one so we know if any are left
+            self.move_generator = self.gamestate.generateMoves()
+            self.expandable_moves = []
+            self.pull_move()
+        else:
+            # Moves are never mutated, a shallow copy is enough
+            self.expandable_moves = list(self.gamestate.getValidMoves())
         # self.expandable_moves = self.gamestate.getValidMoves().copy()
 
         self.visit_counts = 0
@@ -30,6 +49,11 @@ class Node:
         for child in self.children:
             child.print_tree(depth + 1)
 
+    def pull_move(self):
+        for move in self.move_generator:
+            self.expandable_moves.append(move)
+            return
+
     def is_fully_expanded(self):
         return len(self.expandable_moves) == 0 and len(self.children) > 0
     
@@ -51,8 +75,12 @@ class Node:
         return  q_value + self.args['C'] * math.sqrt(math.log(self.visit_counts) / child.visit_counts)
     
     def expand(self):
-        idx = np.random.randint(len(self.expandable_moves))
-        action = self.expandable_moves.pop(idx)
+        if self.args.get('staged_expansion'):
+            action = self.expandable_moves.pop()
+            self.pull_move()
+        else:
+            idx = np.random.randint(len(self.expandable_moves))
+            action = self.expandable_moves.pop(idx)
 
         # child_gamestate = self.gamestate.copy()
         child_gamestate = copy.deepcopy(self.gamestate)
@@ -61,37 +89,9 @@ class Node:
         self.children.append(child)
         return child
     
-    def simulate(self):
-        # value, is_terminal = self.gamestate.getValueAndTerminated()
-        # value = self.gamestate.getOpponentValue(value)
-        # if is_terminal:
-        #     return value
-        
-        # rollout_gamestate = self.gamestate.copy()
-        rollout_gamestate = copy.deepcopy(self.gamestate)
-        rollout_player = rollout_gamestate.whiteToMove
-        action_count = 0
-        print_board(rollout_gamestate.board)
-        while True:
-            action_count+=1
-            valid_moves = rollout_gamestate.getValidMoves()
-            print('Rollout Valid Moves', valid_moves)
-            value, is_terminal = rollout_gamestate.getValueAndTerminated()
-            if value ==1:
-                print("Rollout Value 1 Reached")
-            
-            if is_terminal:
-                if rollout_gamestate.whiteToMove == rollout_player:
-                    return rollout_gamestate.getOpponentValue(value)
-                return value
-            
-            action = valid_moves[np.random.randint(len(valid_moves))]
-            print("Rollout action:", action.getChessNotation())
-            print("Action Count:", action_count)
-            print(rollout_gamestate.drawMoveCounter)
-            rollout_gamestate.makeMove(action)
-            print_board(rollout_gamestate.board)
-            
+    def simulate(self, policy=None):
+        # rollout() undoes its moves, so it can play on this node's own copy
+        return rollout(self.gamestate, policy)
     
     def backpropagate(self, value):
         self.visit_counts += 1
@@ -102,16 +102,282 @@ class Node:
             self.parent.backpropagate(value)
 
 
+def flags_value_and_terminated(gamestate):
+    # getValueAndTerminated without generating the moves again, reads the
+    # flags left by the last getValidMoves call on this position
+    if gamestate.checkmate:
+        return 1, True
+    elif gamestate.stalemate:
+        return 0, True
+    return 0, False
+
+
+class SharedStateNode(Node):
+    """
+    Node that keeps only the move that led to it. The search walks one shared
+    GameState down the tree with makeMove and unwinds it with undoMove, so no
+    node owns a copy of the board, move log or castle rights log.
+    """
+    def __init__(self, args, parent=None, action_taken=None):
+        self.args = args
+        self.parent = parent
+        self.action_taken = action_taken
+
+        self.children = []
+        self.expandable_moves = None  # Generated when the search first stands on this node
+        self.terminal_value = 0
+        self.is_terminal = False
+
+        self.visit_counts = 0
+        self.value_sum = 0
+
+    def generate_moves(self, gamestate):
+        self.expandable_moves = list(gamestate.getValidMoves())
+        self.terminal_value, self.is_terminal = flags_value_and_terminated(gamestate)
+
+    def is_fully_expanded(self):
+        return self.expandable_moves is not None and len(self.expandable_moves) == 0 and len(self.children) > 0
+
+    def expand(self, gamestate):
+        idx = np.random.randint(len(self.expandable_moves))
+        action = self.expandable_moves.pop(idx)
+
+        gamestate.makeMove(action)
+        child = SharedStateNode(self.args, parent=self, action_taken=action)
+        self.children.append(child)
+        return child
+
+    def simulate(self, gamestate, policy=None):
+        return rollout(gamestate, policy)
+
+    def backpropagate(self, value):
+        self.visit_counts += 1
+        self.value_sum += value
+
+        if self.parent is not None:
+            self.parent.backpropagate(-value)
+
+
+class RolloutPolicy:
+    """
+    How rollout() plays a leaf out, read from the MCTS args:
+      rollout_max_plies       playout length cap (default 60, None plays to
+                              the end); a cut-off playout is scored
+                              tanh(material / rollout_material_scale) for the
+                              side to move at the leaf, so in [-1, 1]
+      rollout_material_scale  centipawns that score about 0.76 (default 1000)
+      rollout_capture_bias    chance to play a random capture instead of a
+                              random move when one exists (default 0)
+    """
+    __slots__ = ('max_plies', 'material_scale', 'capture_bias')
+
+    def __init__(self, max_plies=60, material_scale=1000.0, capture_bias=0.0):
+        self.max_plies = max_plies
+        self.material_scale = material_scale
+        self.capture_bias = capture_bias
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.get('rollout_max_plies', 60), args.get('rollout_material_scale', 1000.0),
+                   args.get('rollout_capture_bias', 0.0))
+
+
+DEFAULT_ROLLOUT = RolloutPolicy()
+
+
+def rollout(gamestate, policy=None):
+    """
+    Random playout on a shared state, every move is undone before returning.
+    Moves are generated once per ply, the end-of-game flags come with them.
+    Returns the result for the side to move at the start.
+    """
+    policy = policy if policy is not None else DEFAULT_ROLLOUT
+    rollout_player = gamestate.whiteToMove
+    max_plies = policy.max_plies
+    capture_bias = policy.capture_bias
+    played = 0
+    # Playout positions are seldom seen again, keep them out of the move cache
+    cache, gamestate.moveCache = gamestate.moveCache, None
+    if MCTS_TRACE.debug:
+        MCTS_TRACE.event(Trace.DEBUG, 'rollout_start', board=board_rows(gamestate.board))
+    try:
+        while True:
+            valid_moves = gamestate.getValidMoves()
+            value, is_terminal = flags_value_and_terminated(gamestate)
+            if is_terminal:
+                if gamestate.whiteToMove == rollout_player:
+                    return gamestate.getOpponentValue(value)
+                return value
+            if max_plies is not None and played >= max_plies:
+                # Truncated, score the material instead of a result
+                value = math.tanh(gamestate.material / policy.material_scale)
+                return value if rollout_player else -value
+
+            action = None
+            if capture_bias and np.random.random() < capture_bias:
+                captures = [move for move in valid_moves if move.pieceCaptured != '--']
+                if captures:
+                    action = captures[np.random.randint(len(captures))]
+            if action is None:
+                action = valid_moves[np.random.randint(len(valid_moves))]
+            gamestate.makeMove(action)
+            played += 1
+            if MCTS_TRACE.debug:
+                MCTS_TRACE.event(Trace.DEBUG, 'rollout_action', action=action.getChessNotation(), count=played,
+                                 draw_counter=gamestate.drawMoveCounter, board=board_rows(gamestate.board))
+    finally:
+        for _ in range(played):
+            gamestate.undoMove()
+        gamestate.moveCache = cache
+
+
+class ArrayTree:
+    """
+    MCTS tree stored in flat NumPy arrays instead of one Node object per
+    position. Node 0 is the root; the children of a node are a contiguous
+    index range [first_child, first_child + num_children), created all at
+    once when the node is first expanded. Moves are kept as packed codes and
+    rebuilt with Move.fromPacked when the search walks the shared GameState.
+
+    num_children is -1 for a node that was never expanded and 0 for a
+    terminal one. Arrays double in size when they run out of room.
+    """
+    def __init__(self, capacity=1024):
+        self.size = 1  # Only the root to begin with
+        self.visit_counts = np.zeros(capacity, dtype=np.int64)
+        self.value_sums = np.zeros(capacity, dtype=np.float64)
+        self.priors = np.zeros(capacity, dtype=np.float32)
+        self.parents = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.zeros(capacity, dtype=np.int32)
+        self.num_children = np.full(capacity, -1, dtype=np.int32)
+        self.moves = np.zeros(capacity, dtype=np.int32)
+        self.terminal_values = np.zeros(capacity, dtype=np.float32)
+
+    def _grow(self, needed):
+        capacity = len(self.visit_counts)
+        while capacity < needed:
+            capacity *= 2
+        for name, fill in (('visit_counts', 0), ('value_sums', 0), ('priors', 0), ('parents', -1),
+                           ('first_child', 0), ('num_children', -1), ('moves', 0), ('terminal_values', 0)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def expand(self, node, moves, priors=None):
+        # Append all children of node in one block
+        n = len(moves)
+        start = self.size
+        if start + n > len(self.visit_counts):
+            self._grow(start + n)
+        end = start + n
+        self.moves[start:end] = [move.packed for move in moves]
+        self.parents[start:end] = node
+        self.priors[start:end] = priors if priors is not None else (1.0 / n if n else 0)
+        self.first_child[node] = start
+        self.num_children[node] = n
+        self.size = end
+
+    def children(self, node):
+        start = self.first_child[node]
+        return range(start, start + self.num_children[node])
+
+    def select(self, node, c):
+        """
+        Child with the highest UCB, the same formula as Node.get_ucb computed
+        for every child at once. Unvisited children come first, picked at random.
+        """
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        visits = self.visit_counts[start:end]
+        if not visits.all():
+            unvisited = np.flatnonzero(visits == 0)
+            return start + int(unvisited[np.random.randint(len(unvisited))])
+        inverse = 1.0 / visits
+        # 1 - (q + 1) / 2 == 0.5 - q / 2
+        ucb = 0.5 - 0.5 * self.value_sums[start:end] * inverse + c * math.sqrt(math.log(self.visit_counts[node])) * np.sqrt(inverse)
+        return start + int(ucb.argmax())
+
+    def select_puct(self, node, c):
+        """
+        AlphaZero PUCT: q + c * prior * sqrt(N) / (1 + n), with unvisited
+        children counted as a draw. Used when leaves are scored by an Evaluator.
+        """
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        visits = self.visit_counts[start:end]
+        q_values = np.where(visits > 0, 0.5 - 0.5 * self.value_sums[start:end] / np.maximum(visits, 1), 0.5)
+        ucb = q_values + c * self.priors[start:end] * math.sqrt(max(self.visit_counts[node], 1)) / (1 + visits)
+        return start + int(ucb.argmax())
+
+    def add_virtual_loss(self, path, loss):
+        # Count `loss` lost visits for the player choosing each node, so the next
+        # descents of the same batch spread out. Negative loss takes it back
+        self.visit_counts[path] += loss
+        self.value_sums[path] += loss
+
+    def backpropagate(self, path, value):
+        # path runs root -> leaf; the leaf gets value, each parent the negation of its child
+        path = np.asarray(path)
+        signs = np.where((len(path) - 1 - np.arange(len(path))) % 2 == 0, 1.0, -1.0)
+        self.visit_counts[path] += 1
+        self.value_sums[path] += value * signs
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in (
+            'visit_counts', 'value_sums', 'priors', 'parents', 'first_child', 'num_children', 'moves', 'terminal_values'))
+
+
 class MCTS:
     def __init__(self, gamestate, args):
         self.gamestate = gamestate
         self.args = args
+        self.root = None  # Root of the last search, kept so callers can read its statistics
+        self.worker_reports = []  # Per-worker numbers from the last parallel search
+        self.root_stats = {}  # Move -> merged (visits, value sum) from the last parallel search
+        self.limits = None  # SearchLimits of the running search, if any
+        self.searches_done = 0  # Playouts run by the last search
+        self.on_progress = None  # Called with this MCTS every progress_every playouts
+        self.progress_every = 100
+        self.rollout_policy = RolloutPolicy.from_args(args)
+
+    def next_playout(self):
+        # True while another playout fits in args['num_searches'] (if set) and self.limits (if any)
+        num_searches = self.args.get('num_searches')
+        if num_searches is not None and self.searches_done >= num_searches:
+            return False
+        if self.limits is not None and self.limits.tick():
+            return False
+        self.searches_done += 1
+        if self.on_progress is not None and self.searches_done % self.progress_every == 0:
+            self.on_progress(self)
+        return True
+
+    def playouts(self):
+        while self.next_playout():
+            yield self.searches_done - 1
 
-    def search(self):
+    def search(self, limits=None):
+        """
+        Returns (possible_actions, action_probs) for the root moves. `limits`
+        (Search.SearchLimits) can end the search early on time, nodes (one
+        node = one playout) or a stop signal; with limits, args['num_searches']
+        becomes optional.
+        """
+        self.limits = limits
+        self.searches_done = 0
+        if self.args.get('num_workers', 1) > 1:
+            return self.search_parallel()
+        if self.args.get('evaluator') is not None or self.args.get('batched'):
+            return self.search_batched()
+        if self.args.get('array_tree'):
+            return self.search_array_tree()
+        if self.args.get('shared_state'):
+            return self.search_shared_state()
         # define root
-        root = Node(self.gamestate, self.args)
+        root = self.root = Node(self.gamestate, self.args)
         # selection
-        for search in range(self.args['num_searches']):
+        for search in self.playouts():
             node = root
             while node.is_fully_expanded():
                 node = node.select()
@@ -123,11 +389,12 @@ class MCTS:
             if not is_terminal:
 
                 # expansion
-                print(search)
+                if MCTS_TRACE.debug:
+                    MCTS_TRACE.event(Trace.DEBUG, 'expand', search=search)
                 node = node.expand()
                 
                 # simulation
-                value = node.simulate()
+                value = node.simulate(self.rollout_policy)
 
             # backpropagation
             node.backpropagate(value)
@@ -139,8 +406,324 @@ class MCTS:
             action_probs.append(child.visit_counts)
             possible_actions.append(child.action_taken)
         
-        action_probs = action_probs / np.sum(action_probs)
-        root.print_tree()
-        print('N Searches Really = ', search)
-        print('N Searches = ', self.args['num_searches'])
-        return possible_actions, action_probs
\ No newline at end of file
+        action_probs = visit_distribution(action_probs)
+        if MCTS_TRACE.debug:
+            MCTS_TRACE.event(Trace.DEBUG, 'root_children', children=[
+                (child.action_taken.getChessNotation(), child.visit_counts, child.value_sum) for child in root.children])
+        if MCTS_TRACE.info:
+            MCTS_TRACE.event(Trace.INFO, 'search_done', searches=self.searches_done, requested=self.args.get('num_searches'))
+        return possible_actions, action_probs
+
+    def search_shared_state(self, root=None):
+        """
+        Same search as search(), but on SharedStateNodes: one GameState copy per
+        call is walked down the selected path and unwound after backpropagation.
+        Passing a root from an earlier search keeps growing that tree.
+        """
+        gamestate = copy.deepcopy(self.gamestate)
+        if root is None:
+            root = SharedStateNode(self.args)
+        self.root = root
+        for search in self.playouts():
+            node = root
+            depth = 0
+            # selection
+            while node.is_fully_expanded():
+                node = node.select()
+                gamestate.makeMove(node.action_taken)
+                depth += 1
+
+            if node.expandable_moves is None:
+                node.generate_moves(gamestate)
+            value = gamestate.getOpponentValue(node.terminal_value)
+
+            if not node.is_terminal:
+                # expansion
+                node = node.expand(gamestate)
+                depth += 1
+
+                # simulation
+                value = node.simulate(gamestate, self.rollout_policy)
+
+            # backpropagation
+            node.backpropagate(value)
+            for _ in range(depth):
+                gamestate.undoMove()
+
+        possible_actions = [child.action_taken for child in root.children]
+        action_probs = visit_distribution([child.visit_counts for child in root.children])
+        if MCTS_TRACE.info:
+            MCTS_TRACE.event(Trace.INFO, 'search_done', searches=self.searches_done, children=len(root.children))
+        return possible_actions, action_probs
+
+    def search_parallel(self):
+        """
+        Root parallelism: args['num_workers'] processes each grow their own tree
+        from the root with a different seed and args['worker_searches'] playouts
+        (default num_searches). Visit counts and value sums of the root children
+        are summed over the workers. Seeds are args['seed'] + worker index when
+        a seed is given, so runs can be repeated. Each worker gets the deadline
+        and node budget of self.limits; a stop signal only reaches them at the end.
+        """
+        num_workers = self.args['num_workers']
+        worker_args = dict(self.args, num_workers=1)
+        worker_args['num_searches'] = self.args.get('worker_searches', self.args.get('num_searches'))
+        base_seed = self.args.get('seed', np.random.randint(2**31 - num_workers))
+        worker_limits = self.limits.for_worker() if self.limits is not None else None
+        jobs = [(self.gamestate, worker_args, base_seed + i, worker_limits) for i in range(num_workers)]
+
+        with multiprocessing.Pool(num_workers) as pool:
+            results = pool.starmap(_search_worker, jobs)
+
+        # Moves come back packed, merge on the code and rebuild them against our board
+        visits = {}
+        value_sums = {}
+        self.worker_reports = []
+        for children, report in results:
+            for packed, child_visits, child_value in children:
+                visits[packed] = visits.get(packed, 0) + child_visits
+                value_sums[packed] = value_sums.get(packed, 0) + child_value
+            self.worker_reports.append(report)
+            self.searches_done += report['searches']
+            if self.limits is not None and self.limits.stopped_by is None:
+                self.limits.stopped_by = report['stopped_by']
+            if MCTS_TRACE.info:
+                MCTS_TRACE.event(Trace.INFO, 'worker_done', **report)
+
+        possible_actions = [ChessEngine.Move.fromPacked(packed, self.gamestate.board) for packed in visits]
+        action_probs = visit_distribution([visits[packed] for packed in visits])
+        self.root_stats = {move: (visits[move.packed], value_sums[move.packed]) for move in possible_actions}
+        return possible_actions, action_probs
+
+    def search_array_tree(self):
+        """
+        Shared-state search on an ArrayTree, for large playout counts: no node
+        objects, and UCB selection is one vectorized expression per level.
+        The tree is kept in self.root.
+        """
+        gamestate = copy.deepcopy(self.gamestate)
+        tree = self.root = ArrayTree(self.args.get('tree_capacity', 1024))
+        c = self.args['C']
+        for search in self.playouts():
+            node = 0
+            path = [0]
+            while True:
+                if tree.num_children[node] < 0:
+                    # First time the search stands here with the node visited, create its children
+                    valid_moves = gamestate.getValidMoves()
+                    terminal_value, is_terminal = flags_value_and_terminated(gamestate)
+                    tree.terminal_values[node] = terminal_value
+                    tree.expand(node, [] if is_terminal else valid_moves)
+                if tree.num_children[node] == 0:
+                    value = gamestate.getOpponentValue(tree.terminal_values[node])
+                    break
+                # selection, or expansion when an unvisited child comes back
+                node = tree.select(node, c)
+                gamestate.makeMove(ChessEngine.Move.fromPacked(int(tree.moves[node]), gamestate.board))
+                path.append(node)
+                if tree.visit_counts[node] == 0:
+                    # simulation
+                    value = rollout(gamestate, self.rollout_policy)
+                    break
+
+            # backpropagation
+            tree.backpropagate(path, value)
+            for _ in range(len(path) - 1):
+                gamestate.undoMove()
+
+        children = tree.children(0)
+        possible_actions = [ChessEngine.Move.fromPacked(int(tree.moves[i]), self.gamestate.board) for i in children]
+        action_probs = visit_distribution(tree.visit_counts[children.start:children.stop])
+        if MCTS_TRACE.info:
+            MCTS_TRACE.event(Trace.INFO, 'search_done', searches=self.searches_done,
+                             children=len(children), nodes=tree.size, tree_bytes=tree.nbytes())
+        return possible_actions, action_probs
+
+    def search_batched(self):
+        """
+        Evaluator-driven search on an ArrayTree. Each step descends up to
+        args['batch_size'] times with PUCT, adding args['virtual_loss'] along
+        every path so the descents reach different leaves. The new leaves are
+        encoded with encodeGamestate and scored with one args['evaluator'] call
+        (default NumpyEvaluator), whose priors become the children's priors.
+        """
+        evaluator = self.args.get('evaluator') or NumpyEvaluator()
+        batch_size = self.args.get('batch_size', 8)
+        virtual_loss = self.args.get('virtual_loss', 1)
+        c = self.args['C']
+        gamestate = copy.deepcopy(self.gamestate)
+        tree = self.root = ArrayTree(self.args.get('tree_capacity', 1024))
+        batches = evaluated = 0
+        stopped = False
+        while not stopped:
+            leaves = []  # (path, node, moves) waiting for the evaluator
+            boards = []
+            white_to_move = []
+            pending = set()
+            for _ in range(batch_size):
+                node = 0
+                path = [0]
+                while tree.num_children[node] > 0:
+                    node = tree.select_puct(node, c)
+                    gamestate.makeMove(ChessEngine.Move.fromPacked(int(tree.moves[node]), gamestate.board))
+                    path.append(node)
+
+                if node in pending or not self.next_playout():
+                    # Virtual loss didn't steer this descent away, the batch is as wide as it gets
+                    stopped = node not in pending
+                    for _ in range(len(path) - 1):
+                        gamestate.undoMove()
+                    break
+                if tree.num_children[node] == 0:
+                    # Terminal, scored without the evaluator
+                    tree.backpropagate(path, gamestate.getOpponentValue(tree.terminal_values[node]))
+                else:
+                    valid_moves = gamestate.getValidMoves()
+                    terminal_value, is_terminal = flags_value_and_terminated(gamestate)
+                    if is_terminal:
+                        tree.terminal_values[node] = terminal_value
+                        tree.expand(node, [])
+                        tree.backpropagate(path, gamestate.getOpponentValue(terminal_value))
+                    else:
+                        pending.add(node)
+                        leaves.append((path, node, list(valid_moves)))
+                        boards.append(gamestate.encodeGamestate())
+                        white_to_move.append(gamestate.whiteToMove)
+                        tree.add_virtual_loss(path, virtual_loss)
+                for _ in range(len(path) - 1):
+                    gamestate.undoMove()
+
+            if not leaves:
+                continue
+            priors, values = evaluator.evaluate(np.array(boards, dtype=np.int8), np.array(white_to_move), [moves for _, _, moves in leaves])
+            batches += 1
+            evaluated += len(leaves)
+            for (path, node, moves), node_priors, value in zip(leaves, priors, values):
+                tree.expand(node, moves, node_priors)
+                tree.add_virtual_loss(path, -virtual_loss)
+                tree.backpropagate(path, value)
+
+        children = tree.children(0)
+        possible_actions = [ChessEngine.Move.fromPacked(int(tree.moves[i]), self.gamestate.board) for i in children]
+        action_probs = visit_distribution(tree.visit_counts[children.start:children.stop])
+        if MCTS_TRACE.info:
+            MCTS_TRACE.event(Trace.INFO, 'search_done', searches=self.searches_done, batches=batches,
+                             mean_batch=round(evaluated / batches, 2) if batches else 0, nodes=tree.size)
+        return possible_actions, action_probs
+
+    def root_children(self):
+        # (packed move, visits, value sum) of every root child, for any tree type
+        if isinstance(self.root, ArrayTree):
+            children = self.root.children(0)
+            return [(int(self.root.moves[i]), int(self.root.visit_counts[i]), float(self.root.value_sums[i]))
+                    for i in children]
+        return [(child.action_taken.packed, child.visit_counts, child.value_sum) for child in self.root.children]
+
+    def search_limited(self, limits):
+        """
+        search() within `limits`, answered as a Search.SearchResult: the most
+        visited root move (any legal move if no playout finished), playouts
+        run as nodes, and the visit distribution in info['probs'].
+        """
+        possible_actions, action_probs = self.search(limits)
+        if possible_actions and np.sum(action_probs) > 0:
+            best_move = possible_actions[int(np.argmax(action_probs))]
+        else:
+            moves = self.gamestate.getValidMoves()
+            best_move = moves[0] if moves else None
+        return SearchResult(best_move, nodes=self.searches_done, seconds=limits.elapsed(), stopped_by=limits.stopped_by,
+                            info={'actions': possible_actions, 'probs': action_probs})
+
+
+class PersistentMCTS(MCTS):
+    """
+    Shared-state MCTS that keeps its tree between calls. Each search() first
+    replays the moves played on the GameState since the last search (normally
+    our move and the opponent's reply) down the old tree and continues from
+    that grandchild, so its visits carry over. Everything not on that path is
+    released. An undo, a new game, a different starting position or a move
+    the tree never expanded starts over.
+    """
+    def __init__(self, gamestate, args):
+        super().__init__(gamestate, args)
+        self.history = []  # Packed moves of gamestate.moveLog when self.root was searched
+        self.root_key = None  # zobristKey of the position self.root was searched from
+        self.reused_visits = 0  # Visits the root already had at the start of the last search
+
+    def search(self, limits=None):
+        self.limits = limits
+        self.searches_done = 0
+        root = self.advance_root()
+        self.reused_visits = root.visit_counts if root is not None else 0
+        if MCTS_TRACE.info:
+            MCTS_TRACE.event(Trace.INFO, 'tree_reuse', reused_visits=self.reused_visits)
+        result = self.search_shared_state(root)
+        self.history = [move.packed for move in self.gamestate.moveLog]
+        self.root_key = self.gamestate.zobristKey
+        return result
+
+    def advance_root(self):
+        # Walk the old tree along the moves played since the last search
+        # The same moves from another starting position (a new FEN without a new
+        # game) reach another position, so the key after them must match too
+        moveLog = self.gamestate.moveLog
+        if self.root is None or len(moveLog) < len(self.history) or \
+                [move.packed for move in moveLog[:len(self.history)]] != self.history or \
+                self.gamestate.zobristKeyLog[len(self.history)] != self.root_key:
+            self.reset()
+            return None
+        node = self.root
+        for move in moveLog[len(self.history):]:
+            child = next((child for child in node.children if child.action_taken == move), None)
+            if child is None:
+                self.reset()
+                return None
+            node.children.remove(child)
+            release_tree(node)
+            node = child
+        node.parent = None
+        self.root = node
+        return node
+
+    def reset(self):
+        if self.root is not None:
+            release_tree(self.root)
+        self.root = None
+        self.history = []
+        self.root_key = None
+
+
+def visit_distribution(visit_counts):
+    # Root visit counts as probabilities, all zeros when nothing was visited yet
+    visits = np.asarray(visit_counts, dtype=np.float64)
+    total = visits.sum()
+    return visits / total if total > 0 else visits
+
+
+def release_tree(node):
+    # Children and parents point at each other, break the links so the
+    # discarded nodes are freed right away instead of waiting for the cycle collector
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.children)
+        node.children = []
+        node.parent = None
+
+
+def _search_worker(gamestate, args, seed, limits=None):
+    # Runs in a pool process: one full single-process search from the root
+    np.random.seed(seed)
+    start = time.perf_counter()
+    mcts = MCTS(gamestate, args)
+    mcts.search(limits)
+    children = mcts.root_children()
+    report = {
+        'seed': seed,
+        'searches': mcts.searches_done,
+        'stopped_by': limits.stopped_by if limits is not None else None,
+        'root_visits': sum(visits for _, visits, _ in children),
+        'children': len(children),
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+    return children, report
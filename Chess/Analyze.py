@@ -0,0 +1,145 @@
+import AlphaShrimp
+import ChessAI
+import ChessEngine
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from Search import SearchLimits
+from TranspositionTable import TranspositionTable
+
+ENGINES = ('alphabeta', 'mcts')
+
+# Per worker process, set by _init_worker
+_engine = None
+_mcts_args = None
+_tt = None
+_budget = None
+
+
+def read_positions(path):
+    """
+    Yields (line number, text) for every position in a file of FEN or EPD
+    lines. Blank lines and lines starting with # are skipped. Parsing is left
+    to analyze_position, so a malformed line only fails that position.
+    """
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield number, line
+
+
+def _init_worker(engine, mcts_args, budget, tt_mb):
+    global _engine, _mcts_args, _tt, _budget
+    _engine = engine
+    _mcts_args = mcts_args
+    _budget = budget
+    # One table per process, cleared between positions so results don't depend on the order
+    _tt = TranspositionTable(tt_mb) if engine == 'alphabeta' else None
+
+
+def analyze_position(job):
+    """
+    Searches one position within the per-position budget and returns a
+    JSON-ready dict. Errors (a bad FEN, say) come back as an 'error' field
+    so one broken line doesn't end the run.
+    """
+    index, line, position = job
+    result = {'index': index, 'line': line}
+    try:
+        fen, operations = ChessEngine.parseEpd(position)
+        result['fen'] = fen
+        if 'id' in operations:
+            result['id'] = operations['id'].strip('"')
+        if 'bm' in operations:
+            result['bm'] = operations['bm']
+        gs = ChessEngine.GameState(fen)
+    except ValueError as e:
+        result['position'] = position
+        result['error'] = str(e)
+        return result
+
+    limits = SearchLimits(**_budget)
+    if _engine == 'alphabeta':
+        _tt.clear()
+        search = ChessAI.search(gs, limits, _tt)
+    else:
+        search = AlphaShrimp.MCTS(gs, _mcts_args).search_limited(limits)
+    result.update({
+        'best_move': search.best_move.getChessNotation() if search.best_move is not None else None,
+        'score': search.score,
+        'pv': [move.getChessNotation() for move in search.pv],
+        'depth': search.depth,
+        'nodes': search.nodes,
+        'seconds': round(search.seconds, 4),
+        'nps': search.nps(),
+        'stopped_by': search.stopped_by,
+    })
+    return result
+
+
+def analyze(path, engine='alphabeta', workers=1, movetime=None, nodes=None, depth=None,
+            mcts_args=None, tt_mb=ChessAI.TT_SIZE_MB):
+    """
+    Yields the analysis of every position in `path` as it finishes, spread
+    over `workers` processes. Results arrive in completion order; 'index'
+    gives each one's place in the file. The budget applies to every position
+    separately.
+    """
+    budget = {'movetime': movetime, 'nodes': nodes, 'depth': depth}
+    mcts_args = mcts_args if mcts_args is not None else {'C': 1.4}
+    jobs = ((index, number, position) for index, (number, position) in enumerate(read_positions(path)))
+    initargs = (engine, mcts_args, budget, tt_mb)
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            yield from pool.imap_unordered(analyze_position, jobs)
+    else:
+        _init_worker(*initargs)
+        for job in jobs:
+            yield analyze_position(job)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze every position of a FEN/EPD file, one JSON line per position.")
+    parser.add_argument('positions', help="file with one FEN or EPD position per line")
+    parser.add_argument('--engine', choices=ENGINES, default='alphabeta', help="search to run (default alphabeta)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes (default: one per CPU)")
+    parser.add_argument('--movetime', type=float, help="seconds per position")
+    parser.add_argument('--nodes', type=int, help="nodes per position (MCTS: playouts)")
+    parser.add_argument('--depth', type=int, help="alpha-beta depth per position")
+    parser.add_argument('--searches', type=int, default=1000,
+                        help="MCTS playouts per position when no other budget is given (default 1000)")
+    parser.add_argument('--output', help="write the JSON lines to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.movetime is None and args.nodes is None and args.depth is None and args.engine == 'alphabeta':
+        args.depth = 4  # Iterative deepening needs some bound
+    mcts_args = {'C': 1.4}
+    if args.movetime is None and args.nodes is None:
+        mcts_args['num_searches'] = args.searches
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    start = time.perf_counter()
+    positions = nodes = errors = 0
+    try:
+        for result in analyze(args.positions, args.engine, args.workers, args.movetime, args.nodes, args.depth,
+                              mcts_args):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            positions += 1
+            nodes += result.get('nodes', 0)
+            errors += 'error' in result
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    print(f"{positions} positions ({errors} errors), {nodes} nodes in {seconds:.1f}s "
+          f"({round(nodes / seconds) if seconds > 0 else 0} nps)", file=sys.stderr)
+    return 0 if errors == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
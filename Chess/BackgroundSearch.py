@@ -0,0 +1,123 @@
+import AlphaShrimp
+import copy
+import threading
+import time
+from Search import SearchLimits
+
+
+class BackgroundSearch:
+    """
+    Runs PersistentMCTS searches on a worker thread so a front-end can keep
+    handling events and drawing while the engine thinks.
+
+    start() searches a copy of the position and poll() hands back the
+    Search.SearchResult once it is done. After the engine's move, ponder()
+    guesses the reply (the most visited answer in the tree) and searches the
+    position after it until told otherwise. opponent_moved() turns a correct
+    guess into the real search, keeping the tree and everything found so far;
+    a wrong guess is stopped and the next search starts over.
+    """
+    def __init__(self, args, on_progress=None, progress_every=100):
+        self.args = args
+        self.on_progress = on_progress  # Called from the worker thread with the MCTS
+        self.progress_every = progress_every
+        self.mcts = None
+        self.thread = None
+        self.limits = None
+        self.result = None
+        self.ponder_move = None  # Reply being pondered on, None when searching for real
+        self.lock = threading.Lock()
+
+    def new_game(self):
+        self.stop()
+        self.mcts = None
+
+    def start(self, gamestate, limits):
+        self.stop()
+        self._launch(copy.deepcopy(gamestate), limits, None)
+
+    def _launch(self, gamestate, limits, ponder_move):
+        if self.mcts is None:
+            self.mcts = AlphaShrimp.PersistentMCTS(gamestate, self.args)
+            self.mcts.on_progress = self.on_progress
+            self.mcts.progress_every = self.progress_every
+        self.mcts.gamestate = gamestate
+        self.limits = limits
+        self.result = None
+        self.ponder_move = ponder_move
+        self.thread = threading.Thread(target=self._run, args=(limits,), daemon=True)
+        self.thread.start()
+
+    def _run(self, limits):
+        result = self.mcts.search_limited(limits)
+        with self.lock:
+            self.result = result
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def idle(self):
+        # Nothing running and no result waiting to be polled
+        return not self.busy() and self.result is None
+
+    def poll(self):
+        # The finished search's result, once; None while still thinking or pondering
+        with self.lock:
+            if self.ponder_move is not None or self.result is None or self.busy():
+                return None
+            result, self.result = self.result, None
+            return result
+
+    def stop(self):
+        # Ends the running search or ponder and waits for the thread
+        if self.thread is not None:
+            self.limits.stop()
+            self.thread.join()
+            self.thread = None
+        self.ponder_move = None
+        self.result = None
+
+    def expected_reply(self, move):
+        # Most visited answer to `move` in the last search tree
+        root = self.mcts.root if self.mcts is not None else None
+        if root is None:
+            return None
+        child = next((child for child in root.children if child.action_taken == move), None)
+        if child is None or not child.children:
+            return None
+        return max(child.children, key=lambda reply: reply.visit_counts).action_taken
+
+    def ponder(self, gamestate, move, limits=None):
+        """
+        Call right after the engine played `move` on gamestate. Searches the
+        position after the expected reply within `limits` (default: until
+        opponent_moved or stop).
+        """
+        self.stop()
+        expected = self.expected_reply(move)
+        if expected is None:
+            return False
+        ponder_gamestate = copy.deepcopy(gamestate)
+        ponder_gamestate.makeMove(expected)
+        self._launch(ponder_gamestate, limits if limits is not None else SearchLimits(), expected)
+        return True
+
+    def opponent_moved(self, move, limits):
+        """
+        Call when the opponent plays `move`. On a ponder hit the ponder search
+        carries on as the real search, now bounded by `limits`: its time starts
+        now, its nodes count the pondering too. True is returned. Otherwise
+        any ponder search is dropped.
+        """
+        if self.ponder_move is None:
+            return False
+        if move != self.ponder_move:
+            self.stop()
+            return False
+        # Plain attribute writes, the worker sees them on its next tick
+        self.limits.deadline = time.monotonic() + (limits.deadline - limits.start) if limits.deadline is not None else None
+        self.limits.max_nodes = limits.max_nodes
+        self.limits.stop_event = limits.stop_event
+        with self.lock:
+            self.ponder_move = None
+        return True
@@ -2,35 +2,35 @@ import ChessEngine
 import random
 import numpy as np
 import copy
+import Trace
+from Search import SearchLimits, SearchResult, SearchStopped
+from TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND, NO_MOVE
 
 
-pieceValues = {
-    'p': 100,  # Pawn
-    'R': 500,  # Rook
-    'N': 300,  # Knight
-    'B': 300,  # Bishop
-    'Q': 900,  # Queen
-    'K': 2000000,  # King (very high value to avoid losing it)
-}
+# Loaded from evaluation.json (King gets a very high value to avoid losing it)
+pieceValues = ChessEngine.PIECE_VALUES
+
+TT_SIZE_MB = 16  # Memory budget for the transposition table findBestMove creates
+MATE_SCORE = 10000000  # Above any material difference, below the table's int32 range
+MATE_BOUND = MATE_SCORE - 1000  # Scores past this are mate in (MATE_SCORE - score) plies
+MAX_SEARCH_DEPTH = 64  # Iterative deepening cap when only time or nodes limit the search
 
 def evaluate_position(gs):
-    whitePiecesVal = 0
-    blackPiecesVal = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board)):
-            piece = gs.board[row][col]
-            if piece[0] == 'w':
-                whitePiecesVal += pieceValues.get(piece[1], 0)
-            elif piece[0] == 'b':
-                blackPiecesVal += pieceValues.get(piece[1], 0)
-    
-    evaluation = whitePiecesVal - blackPiecesVal
+    # Material and piece-square sums are maintained incrementally by the GameState
+    evaluation = gs.getEvaluation()
     if not gs.whiteToMove:
         evaluation = -evaluation
     
     return evaluation
 
-def build_move_tree(gs, depth, whitePlayer):
+def _claim_table(tt, score_kind):
+    # Tree mode stores path sums, alpha-beta negamax scores: one table can't serve both
+    if tt.score_kind is None:
+        tt.score_kind = score_kind
+    elif tt.score_kind != score_kind:
+        raise ValueError(f"transposition table holds {tt.score_kind} scores, clear() it before a {score_kind} search")
+
+def build_move_tree(gs, depth, whitePlayer, tt=None):
     """
     Build a tree of all possible move‐sequences up to `depth`.
     Each node is a dict:
@@ -39,15 +39,44 @@ def build_move_tree(gs, depth, whitePlayer):
         "captured":   int,            # value of capture on this move
         "children":   [child_nodes...]
       }
+    Nodes whose position was already searched to the same depth are not
+    expanded again, they keep the cached result in "value" instead. The root
+    always is, the table only orders its moves. `tt` must not be shared with
+    alpha-beta searches.
     """
+    if tt is not None:
+        _claim_table(tt, 'path_sum')
     root = {"move": None, "captured": 0, "children": []}
-    _expand_node(gs, pieceValues, depth, root, whitePlayer)
+    _expand_node(gs, pieceValues, depth, root, whitePlayer, tt)
     return root
 
-def _expand_node(gs, pieceValues, depth, node, whitePlayer):
+def _expand_node(gs, pieceValues, depth, node, whitePlayer, tt=None):
+    # Returns the best path sum below node, the value find_max_capture_path computes for it
     if depth == 0:
-        return
-    for move in gs.getValidMoves():
+        return 0
+    key = gs.zobristKey
+    tt_move = NO_MOVE
+    if tt is not None:
+        entry = tt.probe(key)
+        if entry is not None:
+            entry_depth, score, bound, tt_move = entry
+            # Path sums don't grow monotonically with depth, only a same-depth result can stand in.
+            # Never at the root, whose children are the answer
+            if entry_depth == depth and bound == EXACT and node["move"] is not None:
+                node["value"] = score
+                return score
+
+    moves = gs.getValidMoves()
+    if tt_move != NO_MOVE:
+        # Search the move that was best last time first
+        for i, move in enumerate(moves):
+            if move.packed == tt_move:
+                moves.insert(0, moves.pop(i))
+                break
+
+    best_value = 0
+    best_move = None
+    for move in moves:
         # captured_value = pieceValues.get(move.pieceCaptured[1], 0)
         # if (whitePlayer and not gs.whiteToMove) or (not whitePlayer and gs.whiteToMove):
         #     captured_value = -captured_value
@@ -62,19 +91,26 @@ def _expand_node(gs, pieceValues, depth, node, whitePlayer):
         node["children"].append(child)
 
         # 4) recurse one level deeper
-        _expand_node(gs, pieceValues, depth - 1, child, whitePlayer)
+        value = evaluation + _expand_node(gs, pieceValues, depth - 1, child, whitePlayer, tt)
+        if best_move is None or value > best_value:
+            best_value, best_move = value, move
 
         # 5) undo the move so we can try the next sibling
         gs.undoMove()
 
+    node["value"] = best_value
+    if tt is not None:
+        tt.store(key, depth, best_value, EXACT, best_move.packed if best_move else NO_MOVE)
+    return best_value
+
 def find_max_capture_path(tree):
     """
     Returns (path, total_value), where path is list of move_objs
     that gives the maximum sum of captured values.
     """
-    # Base: leaf
+    # Base: leaf, or a transposition whose value came from the table
     if not tree["children"]:
-        return [], 0
+        return [], tree.get("value", 0)
 
     best_sum = float("-inf")
     best_path = []
@@ -89,16 +125,188 @@ def find_max_capture_path(tree):
 
     return best_path, best_sum
 
-def findBestMove(gs, whitePlayer, depth):
+def _to_tt_score(score, ply):
+    # Mate scores are stored relative to the stored position, not the root
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def _from_tt_score(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+def _negamax(gs, depth, alpha, beta, ply, tt, pv, limits=None):
+    """
+    Alpha-beta in negamax form on the working GameState. Scores are from the
+    side to move's point of view; `pv` is filled with the best line found.
+    Raises SearchStopped when `limits` run out, leaving moves on the board.
+    """
+    if limits is not None and limits.tick():
+        raise SearchStopped()
+    key = gs.zobristKey
+    alpha_orig = alpha
+    tt_move = NO_MOVE
+    entry = tt.probe(key)
+    if entry is not None:
+        entry_depth, score, bound, tt_move = entry
+        if entry_depth >= depth and ply > 0:
+            score = _from_tt_score(score, ply)
+            if bound == EXACT:
+                return score
+            if bound == LOWER_BOUND:
+                alpha = max(alpha, score)
+            elif bound == UPPER_BOUND:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+
+    if depth == 0:
+        return _quiescence(gs, alpha, beta, ply, limits)
+    if gs.drawMoveCounter >= 100:
+        return 0
+
+    # Staged generation: a cutoff on the hash move or a capture skips generating the quiet moves
+    hash_move = ChessEngine.Move.fromPacked(tt_move, gs.board) if tt_move != NO_MOVE else None
+    best_score = -MATE_SCORE - 1
+    best_move = None
+    for move in gs.generateMoves(hash_move):
+        line = []
+        gs.makeMove(move)
+        score = -_negamax(gs, depth - 1, -beta, -alpha, ply + 1, tt, line, limits)
+        gs.undoMove()
+        if score > best_score:
+            best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+                pv[:] = [move] + line
+                if alpha >= beta:
+                    break  # Opponent won't allow this line
+
+    if best_move is None:  # No legal moves
+        in_check = gs.checkForPinsAndChecks()[0]
+        return -MATE_SCORE + ply if in_check else 0  # Prefer the quickest mate, delay being mated
+
+    if best_score <= alpha_orig:
+        bound = UPPER_BOUND
+    elif best_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    tt.store(key, depth, _to_tt_score(best_score, ply), bound, best_move.packed)
+    return best_score
+
+def _quiescence(gs, alpha, beta, ply, limits=None):
+    """
+    Horizon extension for _negamax: only captures and promotions are searched
+    (every move when in check), until the position is quiet, so the static
+    evaluation is never taken halfway through an exchange. Out of check the
+    side to move may also stand pat, i.e. decline every capture.
+    """
+    if limits is not None and limits.tick():
+        raise SearchStopped()
+    in_check = gs.checkForPinsAndChecks()[0]
+    if in_check:
+        best_score = -MATE_SCORE + ply  # Stays if there is no evasion
+    else:
+        best_score = evaluate_position(gs)
+        if best_score >= beta:
+            return best_score
+        alpha = max(alpha, best_score)
+
+    for move in gs.generateMoves(quiets=in_check):
+        gs.makeMove(move)
+        score = -_quiescence(gs, -beta, -alpha, ply + 1, limits)
+        gs.undoMove()
+        if score > best_score:
+            best_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return best_score
+
+def search(gs, limits, tt=None, on_iteration=None):
+    """
+    Anytime iterative deepening negamax. Each iteration leaves its best moves
+    in the transposition table, which orders the next, deeper one. Only the
+    current path lives on the GameState (make/undo), so memory stays flat with
+    depth. Runs until limits.max_depth (default MAX_SEARCH_DEPTH), a forced
+    mate, or a time/node limit or stop; an interrupted iteration still
+    contributes the best root move it had proven, since the previous best
+    move is always searched first; its score is then None, the previous
+    iteration's belongs to another move. Returns a SearchResult. on_iteration, if
+    given, is called with a SearchResult after every completed iteration.
+    """
+    if tt is None:
+        tt = TranspositionTable(TT_SIZE_MB)
+    _claim_table(tt, 'negamax')
+    tt.new_search()
+    moves_played = len(gs.moveLog)
+    pv, score, completed = [], 0, 0
+    for depth in range(1, (limits.max_depth or MAX_SEARCH_DEPTH) + 1):
+        line = []
+        try:
+            score = _negamax(gs, depth, -MATE_SCORE - 1, MATE_SCORE + 1, 0, tt, line, limits)
+        except SearchStopped:
+            # Unwind the moves the interrupted iteration left on the board
+            while len(gs.moveLog) > moves_played:
+                gs.undoMove()
+            if line and (not pv or line[0] != pv[0]):
+                # A new root move proved better than the old best, but its
+                # score never came back up to the root: report none for it
+                pv, score = line, None
+            break
+        completed = depth
+        if line:
+            pv = line
+        if on_iteration is not None and pv:
+            on_iteration(SearchResult(pv[0], score, list(pv), depth, limits.nodes, limits.elapsed()))
+        if abs(score) > MATE_BOUND:
+            break  # Forced mate found, deeper iterations can't improve on it
+    if not pv:
+        # Stopped before the first root move was searched, any legal move beats none
+        moves = gs.getValidMoves()
+        pv, score = [moves[0]] if moves else [], None
+    return SearchResult(pv[0] if pv else None, score, pv, completed, limits.nodes, limits.elapsed(),
+                        limits.stopped_by, {'tt': tt.stats()})
+
+def search_alpha_beta(gs, max_depth, tt=None):
+    """
+    search() to a fixed depth. Returns (principal variation, score for the side to move).
+    """
+    result = search(gs, SearchLimits(depth=max_depth), tt)
+    return result.pv, result.score
+
+def findBestMove(gs, whitePlayer, depth, tt=None, mode='tree', limits=None):
+    """
+    mode 'tree' builds the full move tree and follows the best path sum,
+    mode 'alphabeta' runs search() to `depth`, or within `limits` when given.
+    The two modes store different scores, a `tt` passed in must stay with one
+    of them (ValueError otherwise).
+    """
     gs = copy.deepcopy(gs)
-    tree = build_move_tree(gs, depth=depth, whitePlayer=whitePlayer)
+    if tt is None:
+        tt = TranspositionTable(TT_SIZE_MB)
+    if mode == 'alphabeta':
+        result = search(gs, limits if limits is not None else SearchLimits(depth=depth), tt)
+        if Trace.SEARCH.info:
+            Trace.SEARCH.event(Trace.INFO, 'alphabeta_result', pv=result.pv, score=result.score, depth=result.depth,
+                               nodes=result.nodes, seconds=round(result.seconds, 4), stopped_by=result.stopped_by)
+        return result.best_move
+    tt.new_search()
+    tree = build_move_tree(gs, depth=depth, whitePlayer=whitePlayer, tt=tt)
     # print(tree)
     best_moves, best_value = find_max_capture_path(tree)
     if best_value == 0:
         return random.choice(best_moves)
 
-    print(best_moves)
-    print(best_value)
+    if Trace.SEARCH.info:
+        Trace.SEARCH.event(Trace.INFO, 'tree_result', moves=best_moves, value=best_value, depth=depth)
     return best_moves[0]
 
 if __name__ == "__main__":
@@ -1,4 +1,182 @@
-import copy
+import json
+import os
+import random
+import threading
+from array import array
+from collections import OrderedDict
+import Trace
+
+MOVEGEN_TRACE = Trace.MOVEGEN
+MAKEMOVE_TRACE = Trace.MAKEMOVE
+
+# Bitboards: bit (row * 8 + col) is set when the piece is on that square,
+# the same square numbering Move.encodeMove uses (a8 = 0, h1 = 63)
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK',
+          'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+
+FULL_BOARD = 0xFFFFFFFFFFFFFFFF
+FILE_A = 0x0101010101010101
+FILE_B = FILE_A << 1
+FILE_G = FILE_A << 6
+FILE_H = FILE_A << 7
+ROWS = [0xFF << (8 * r) for r in range(8)]
+# Squares a piece may start from when shifting dc columns without wrapping
+SHIFT_MASKS = {
+    0: FULL_BOARD,
+    1: FULL_BOARD ^ FILE_H,
+    2: FULL_BOARD ^ (FILE_G | FILE_H),
+    -1: FULL_BOARD ^ FILE_A,
+    -2: FULL_BOARD ^ (FILE_A | FILE_B),
+}
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_OFFSETS = ((-2, -1), (-1, -2), (1, -2), (2, -1),
+                  (2, 1), (1, 2), (-1, 2), (-2, 1))
+KING_OFFSETS = QUEEN_DIRECTIONS
+PROMOTION_CHOICES = ('Q', 'R', 'B', 'N')
+# Most valuable victim / least valuable attacker: captures sort by victim first, then cheapest attacker
+CAPTURE_ORDER = {'p': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+MOVE_CACHE_SIZE = 4096  # Positions a GameState remembers the legal moves of, see MoveCache
+
+# Packed moves (16 bits): start square | end square << 6 | promotion choice << 12 | kind << 14
+MOVE_NORMAL = 0
+MOVE_PROMOTION = 1
+MOVE_ENPASSANT = 2
+MOVE_CASTLE = 3
+
+# Zobrist keys, fixed seed so position keys are stable between runs and processes
+_zobristRandom = random.Random(0x5EED5)
+ZOBRIST_PIECES = [[_zobristRandom.getrandbits(64) for _ in range(64)] for _ in PIECES]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(4)]  # wks, wqs, bks, bqs
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)]  # One per file
+
+
+def squareBit(r, c):
+    return 1 << (r * 8 + c)
+
+
+def shiftBitboard(bb, dr, dc):
+    bb &= SHIFT_MASKS[dc]
+    delta = dr * 8 + dc
+    if delta > 0:
+        return (bb << delta) & FULL_BOARD
+    return bb >> -delta
+
+
+def stepAttacks(bb, offsets):
+    attacks = 0
+    for dr, dc in offsets:
+        attacks |= shiftBitboard(bb, dr, dc)
+    return attacks
+
+
+def slidingAttacks(bb, directions, occupied):
+    # Walks each ray until it leaves the board or hits an occupied square (included)
+    attacks = 0
+    for dr, dc in directions:
+        ray = shiftBitboard(bb, dr, dc)
+        while ray:
+            attacks |= ray
+            if ray & occupied:
+                break
+            ray = shiftBitboard(ray, dr, dc)
+    return attacks
+
+
+def pawnAttacks(bb, white):
+    dr = -1 if white else 1
+    return shiftBitboard(bb, dr, -1) | shiftBitboard(bb, dr, 1)
+
+
+def bitScan(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def castleRightsKey(rights):
+    key = 0
+    for i, right in enumerate((rights.wks, rights.wqs, rights.bks, rights.bqs)):
+        if right:
+            key ^= ZOBRIST_CASTLING[i]
+    return key
+
+
+# Precomputed attack tables, indexed by square
+KNIGHT_ATTACKS = [stepAttacks(1 << sq, KNIGHT_OFFSETS) for sq in range(64)]
+KING_ATTACKS = [stepAttacks(1 << sq, KING_OFFSETS) for sq in range(64)]
+PAWN_ATTACKS = [[pawnAttacks(1 << sq, white) for sq in range(64)] for white in (True, False)]  # [0] white, [1] black
+# RAYS[d][sq]: every square from sq to the edge in QUEEN_DIRECTIONS[d], sq excluded
+RAYS = [[slidingAttacks(1 << sq, (direction,), 0) for sq in range(64)] for direction in QUEEN_DIRECTIONS]
+# Rays towards higher square numbers meet their nearest blocker at the lowest set bit
+RAY_TOWARDS_LSB = [dr * 8 + dc > 0 for dr, dc in QUEEN_DIRECTIONS]
+ROOK_RAYS = [RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)]
+BISHOP_RAYS = [RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)]
+# BETWEEN[a][b]: squares strictly between two aligned squares, LINE[a][b]: the whole
+# line through them. Both are 0 when a and b don't share a rank, file or diagonal
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _a in range(64):
+    for _d, (_dr, _dc) in enumerate(QUEEN_DIRECTIONS):
+        _opposite = QUEEN_DIRECTIONS.index((-_dr, -_dc))
+        _ray = RAYS[_d][_a]
+        while _ray:
+            _b = bitScan(_ray)
+            _ray &= _ray - 1
+            BETWEEN[_a][_b] = RAYS[_d][_a] ^ RAYS[_d][_b] ^ (1 << _b)
+            LINE[_a][_b] = RAYS[_d][_a] | RAYS[_opposite][_a] | (1 << _a)
+
+# Evaluation terms, signed from white's point of view and indexed like the
+# bitboards: PIECE_VALUE_SCORES[piece], PIECE_SQUARE_SCORES[piece][sq]
+EVAL_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluation.json')
+PIECE_VALUES = {}
+PIECE_VALUE_SCORES = [0] * len(PIECES)
+PIECE_SQUARE_SCORES = [[0] * 64 for _ in PIECES]
+
+
+def loadEvaluationConfig(path=EVAL_CONFIG_PATH):
+    """
+    Load piece values and piece-square tables from a JSON file. The tables are
+    updated in place, GameStates created before the call need syncEvaluation().
+    """
+    with open(path) as f:
+        config = json.load(f)
+    PIECE_VALUES.clear()
+    PIECE_VALUES.update(config['pieceValues'])
+    tables = config.get('pieceSquareTables', {})
+    for i, piece in enumerate(PIECES):
+        sign = 1 if piece[0] == 'w' else -1
+        table = tables.get(piece[1], [0] * 64)
+        PIECE_VALUE_SCORES[i] = sign * PIECE_VALUES.get(piece[1], 0)
+        for sq in range(64):
+            # Tables are written for white, black reads them upside down (row r -> 7 - r)
+            PIECE_SQUARE_SCORES[i][sq] = sign * table[sq if sign > 0 else sq ^ 56]
+
+
+loadEvaluationConfig()
+
+
+def rayAttacks(sq, d, occupied):
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        # Cut the ray behind the nearest blocker, which stays attacked
+        blocker = (blockers & -blockers).bit_length() - 1 if RAY_TOWARDS_LSB[d] else blockers.bit_length() - 1
+        ray ^= RAYS[d][blocker]
+    return ray
+
+
+def rookAttacks(sq, occupied):
+    return rayAttacks(sq, 0, occupied) | rayAttacks(sq, 1, occupied) | rayAttacks(sq, 2, occupied) | rayAttacks(sq, 3, occupied)
+
+
+def bishopAttacks(sq, occupied):
+    return rayAttacks(sq, 4, occupied) | rayAttacks(sq, 5, occupied) | rayAttacks(sq, 6, occupied) | rayAttacks(sq, 7, occupied)
 
 
 class CastleRights:
@@ -10,6 +188,10 @@ class CastleRights:
 
 
 class Move:
+    # No per-instance __dict__, millions of these get created per search
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured',
+                 'pawnPromotion', 'promotionChoice', 'enpassantMove', 'castleMove', 'packed')
+
     ranksToRows = {'1': 7, '2': 6, '3': 5,
                    '4': 4, '5': 3, '6': 2, '7': 1, '8': 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
@@ -17,7 +199,7 @@ class Move:
                    'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enpassantMove=False, pawnPromotion=False, castleMove=False):
+    def __init__(self, startSq, endSq, board, enpassantMove=False, pawnPromotion=False, castleMove=False, promotionChoice='Q'):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -26,19 +208,39 @@ class Move:
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
         # Pawn promotion
-        # self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
-        self.pawnPromotion = pawnPromotion
+        self.pawnPromotion = pawnPromotion or (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.promotionChoice = promotionChoice if self.pawnPromotion else None
         # En passant
         self.enpassantMove = enpassantMove
         self.castleMove = castleMove
         if self.enpassantMove:
             self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'
 
+        self.packed = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6
+        if self.pawnPromotion:
+            self.packed |= PROMOTION_CHOICES.index(self.promotionChoice) << 12 | MOVE_PROMOTION << 14
+        elif self.enpassantMove:
+            self.packed |= MOVE_ENPASSANT << 14
+        elif self.castleMove:
+            self.packed |= MOVE_CASTLE << 14
+
         # print(
         #     f"Move created: {self.startRow, self.startCol} to {self.endRow, self.endCol}")
         # print(
         #     f'flag values, enpassantMove: {self.enpassantMove}, pawnPromotion: {self.pawnPromotion}, castleMove: {self.castleMove}')
 
+    @classmethod
+    def fromPacked(cls, packed, board):
+        # Rebuilds the Move on the position it was generated for
+        start = packed & 63
+        end = (packed >> 6) & 63
+        kind = packed >> 14
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board,
+                   enpassantMove=kind == MOVE_ENPASSANT,
+                   pawnPromotion=kind == MOVE_PROMOTION,
+                   castleMove=kind == MOVE_CASTLE,
+                   promotionChoice=PROMOTION_CHOICES[(packed >> 12) & 3])
+
     def encodeMove(self):
         start_index = self.startRow * 8 + self.startCol
         end_index = self.endRow * 8 + self.endCol
@@ -51,11 +253,15 @@ class Move:
         ]
 
     def __eq__(self, other):
+        # Squares and promotion choice, so a Move built from two clicks matches
+        # the generated castle/en passant move without knowing its kind
         if isinstance(other, Move):
-            return (self.startRow == other.startRow and self.startCol == other.startCol and
-                    self.endRow == other.endRow and self.endCol == other.endCol)
+            return self.packed & 0x3FFF == other.packed & 0x3FFF
         return False
 
+    def __hash__(self):
+        return self.packed & 0x3FFF
+
     def __repr__(self):
         return self.__str__()
 
@@ -63,14 +269,118 @@ class Move:
         return f"{self.getChessNotation()} ({self.pieceMoved} -> {self.pieceCaptured})"
 
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.pawnPromotion and self.promotionChoice != 'Q':  # Queen is the default, only spell out underpromotions
+            notation += self.promotionChoice.lower()
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
 
+class MoveCache:
+    """
+    Bounded LRU map from GameState.zobristKey to that position's legal moves
+    and whether the side to move is in check. getValidMoves rebuilds the
+    checkmate/stalemate flags from those two and the 50-move counter, which
+    the key leaves out. Copies of a GameState share its cache, also the copies
+    a background search works on in another thread, so every access holds
+    the lock. A pickled one arrives with an empty cache of the same size.
+    """
+    __slots__ = ('maxSize', 'entries', 'hits', 'misses', 'evictions', 'lock')
+
+    def __init__(self, maxSize=MOVE_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()  # key -> (tuple of moves, inCheck), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            # Pop and reinsert rather than move_to_end, a missing key is just a miss
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, moves, inCheck):
+        entry = (tuple(moves), inCheck)
+        with self.lock:
+            self.entries[key] = entry
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {'maxSize': self.maxSize}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxSize'])
+
+
+def parseEpd(line):
+    """
+    Splits an EPD or FEN line into (FEN, operations). EPD operations follow
+    the four position fields as `opcode operands;`, e.g. `bm Nf3; id "WAC.001";`,
+    and come back as {opcode: operand string}. A full FEN has none.
+    """
+    fields = line.strip().split(None, 4)
+    if len(fields) < 2:
+        raise ValueError(f"invalid EPD: {line!r}")
+    rest = fields[4] if len(fields) > 4 else ''
+    head = ' '.join(fields[:4] + ['-'] * (4 - len(fields[:4])))
+    # Halfmove and fullmove numbers make it a FEN, with at most a trailing comment
+    numbers = rest.split(None, 2)
+    if len(numbers) >= 2 and numbers[0].isdigit() and numbers[1].isdigit():
+        return f"{head} {numbers[0]} {numbers[1]}", {}
+    operations = {}
+    operation, quoted = '', False
+    for ch in rest:
+        if ch == '"':
+            quoted = not quoted
+        if ch == ';' and not quoted:
+            opcode, _, operand = operation.strip().partition(' ')
+            if opcode:
+                operations[opcode] = operand.strip()
+            operation = ''
+        else:
+            operation += ch
+    hmvc = operations.get('hmvc', '0')
+    fmvn = operations.get('fmvn', '1')
+    return f"{head} {hmvc} {fmvn}", operations
+
+
 class GameState:
-    def __init__(self):
+    debugZobrist = False  # Recompute the key from scratch after every make/undo and compare
+
+    def __init__(self, fen=None, moveCacheSize=MOVE_CACHE_SIZE):
         # self.board = [
         #     ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
         #     ['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
@@ -81,7 +391,7 @@ class GameState:
         #     ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
         #     ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
         # ]
-        self.board = [
+        board = [
             ['--', 'bR', '--', 'bK', '--', '--', '--', 'bR'],
             ['--', '--', '--', '--', '--', '--', '--', '--'],
             ['--', '--', '--', '--', '--', '--', '--', '--'],
@@ -91,7 +401,7 @@ class GameState:
             ['--', '--', '--', '--', '--', '--', '--', '--'],
             ['--', '--', '--', '--', 'wK', '--', '--', '--']
         ]
-        # self.board = [
+        # board = [
         #     ['--', '--', '--', '--', '--', '--', '--', '--'],
         #     ['--', '--', '--', '--', '--', '--', '--', '--'],
         #     ['--', '--', '--', '--', '--', '--', '--', '--'],
@@ -105,20 +415,19 @@ class GameState:
         self.moveLog = []
         self.whiteKingLocation = (7, 4)  # Initial position of the white king
         self.blackKingLocation = (0, 4)  # Initial position of the black
-        for r in range(1, len(self.board[0])):
-            for c in range(1, len(self.board[1])):
-                if self.board[r][c] == 'wK':
-                    self.whiteKingLocation = (r, c)
-                elif self.board[r][c] == 'bK':
-                    self.blackKingLocation = (r, c)
+        self.setBoard(board)
         self.checkmate = False  # True if the game is in checkmate
         self.stalemate = False  # True if the game is in stalemate
         self.inCheck = False  # True if the current player is in check
         self.pins = []  # List of pinned pieces
         self.checks = []  # List of checks on the current player
+        self.pinMasks = {}  # Square -> squares a pinned piece may still move to
+        self.checkMask = FULL_BOARD  # Squares that resolve the current check
+        self.kingDanger = 0  # Squares attacked by the opponent, king removed
         self.enpassantPossible = ()  # Coordinates for where en passant capture is possible
+        self.enpassantPossibleLog = [self.enpassantPossible]
         # White king side, white queen side, black king side, black queen side
-        
+
         self.currentCastleRights = CastleRights(False, False, False, False)
         # self.currentCastleRights = CastleRights(True, True, True, True)
         # self.caslteRightsLog = [self.currentCastleRights]
@@ -127,104 +436,311 @@ class GameState:
             # List to keep track of castle rights after each move
             self.currentCastleRights.bks, self.currentCastleRights.bqs)]
         self.drawMoveCounter = 0  # Counter for 50-move rule
+        self.drawMoveCounterLog = [self.drawMoveCounter]
+        self.plyOffset = 0  # Plies played before the starting position, for the FEN fullmove number
+        self.moveCache = MoveCache(moveCacheSize) if moveCacheSize else None  # None turns caching off
+        self.syncZobristKey()
+        if fen is not None:
+            self.setFen(fen)
+
+    @classmethod
+    def fromFen(cls, fen):
+        return cls(fen)
+
+    def setFen(self, fen):
+        """
+        Sets up the position of a FEN string and clears the move history.
+        Everything after the side to move may be left out, as in EPD:
+        no castling, no en passant square, halfmove clock 0, move 1.
+        """
+        fields = fen.split()
+        ranks = fields[0].split('/') if fields else []
+        if len(ranks) != 8 or len(fields) < 2 or fields[1] not in ('w', 'b'):
+            raise ValueError(f"invalid FEN: {fen!r}")
+        board = []
+        for rank in ranks:
+            row = []
+            for ch in rank:
+                if ch in '12345678':
+                    row.extend(['--'] * int(ch))
+                elif ch.lower() in 'pnbrqk':
+                    row.append(('w' if ch.isupper() else 'b') + ('p' if ch.lower() == 'p' else ch.upper()))
+                else:
+                    raise ValueError(f"invalid FEN: {fen!r}")
+            if len(row) != 8:
+                raise ValueError(f"invalid FEN: {fen!r}")
+            board.append(row)
+        castling = fields[2] if len(fields) > 2 else '-'
+        enpassant = fields[3] if len(fields) > 3 else '-'
+
+        self.setBoard(board)
+        self.whiteToMove = fields[1] == 'w'
+        self.moveLog = []
+        self.checkmate = self.stalemate = self.inCheck = False
+        self.currentCastleRights = CastleRights('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)
+        self.castleRightsLog = [CastleRights('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)]
+        if enpassant != '-':
+            if len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or enpassant[1] not in Move.ranksToRows:
+                raise ValueError(f"invalid FEN: {fen!r}")
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        else:
+            self.enpassantPossible = ()
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.drawMoveCounter = int(fields[4]) if len(fields) > 4 else 0
+        self.drawMoveCounterLog = [self.drawMoveCounter]
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.plyOffset = 2 * (max(fullmove, 1) - 1) + (0 if self.whiteToMove else 1)
+        self.syncZobristKey()
+
+    def getFen(self):
+        placement = []
+        for row in self.board:
+            rank, empty = '', 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            placement.append(rank + (str(empty) if empty else ''))
+        rights = self.currentCastleRights
+        castling = ''.join(flag for flag, kept in zip('KQkq', (rights.wks, rights.wqs, rights.bks, rights.bqs)) if kept)
+        if self.enpassantPossible != ():
+            r, c = self.enpassantPossible
+            enpassant = Move.colsToFiles[c] + Move.rowsToRanks[r]
+        else:
+            enpassant = '-'
+        fullmove = (self.plyOffset + len(self.moveLog)) // 2 + 1
+        return (f"{'/'.join(placement)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} "
+                f"{self.drawMoveCounter} {fullmove}")
+
+    def getEpd(self, operations=None):
+        # The first four FEN fields plus `opcode operand;` pairs, e.g. {'id': '"WAC.001"'}
+        epd = ' '.join(self.getFen().split()[:4])
+        for opcode, operand in (operations or {}).items():
+            epd += f" {opcode} {operand};" if operand != '' else f" {opcode};"
+        return epd
+
+    def setBoard(self, board):
+        # self.board stays an 8x8 list of piece strings so the GUI and the
+        # Move constructor can index it; the bitboards are the source for move generation
+        self.board = [list(row) for row in board]
+        self.bitboards = [0] * len(PIECES)
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.bitboards[PIECE_INDEX[piece]] |= squareBit(r, c)
+        self.whitePieces = 0
+        self.blackPieces = 0
+        for i in range(6):
+            self.whitePieces |= self.bitboards[i]
+            self.blackPieces |= self.bitboards[i + 6]
+        self.occupied = self.whitePieces | self.blackPieces
+        if self.bitboards[PIECE_INDEX['wK']]:
+            self.whiteKingLocation = divmod(bitScan(self.bitboards[PIECE_INDEX['wK']]), 8)
+        if self.bitboards[PIECE_INDEX['bK']]:
+            self.blackKingLocation = divmod(bitScan(self.bitboards[PIECE_INDEX['bK']]), 8)
+        self.syncEvaluation()
+
+    def computeEvaluation(self):
+        # (material, piece-square) sums from scratch, white minus black
+        material = positional = 0
+        for i, pieces in enumerate(self.bitboards):
+            while pieces:
+                sq = bitScan(pieces)
+                pieces &= pieces - 1
+                material += PIECE_VALUE_SCORES[i]
+                positional += PIECE_SQUARE_SCORES[i][sq]
+        return material, positional
+
+    def syncEvaluation(self):
+        # Call after loadEvaluationConfig or after editing the board directly
+        self.material, self.positional = self.computeEvaluation()
+
+    def getEvaluation(self):
+        # Static evaluation from white's point of view, kept up to date by makeMove/undoMove
+        return self.material + self.positional
+
+    @property
+    def zobristKey(self):
+        return self._zobristKey
+
+    def computeZobristKey(self):
+        key = 0
+        for i, pieces in enumerate(self.bitboards):
+            while pieces:
+                sq = bitScan(pieces)
+                pieces &= pieces - 1
+                key ^= ZOBRIST_PIECES[i][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= castleRightsKey(self.currentCastleRights)
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    def syncZobristKey(self):
+        # Call after editing the position directly instead of through makeMove
+        self._zobristKey = self.computeZobristKey()
+        self.zobristKeyLog = [self._zobristKey]
+
+    def checkZobristKey(self):
+        expected = self.computeZobristKey()
+        if self._zobristKey != expected:
+            raise RuntimeError(
+                f"Zobrist key drifted after {len(self.moveLog)} moves: {self._zobristKey:#018x} != {expected:#018x}")
+
+    def _putPiece(self, r, c, piece):
+        sq = r * 8 + c
+        bit = 1 << sq
+        index = PIECE_INDEX[piece]
+        self.board[r][c] = piece
+        self.bitboards[index] |= bit
+        self._zobristKey ^= ZOBRIST_PIECES[index][sq]
+        self.material += PIECE_VALUE_SCORES[index]
+        self.positional += PIECE_SQUARE_SCORES[index][sq]
+        if piece[0] == 'w':
+            self.whitePieces |= bit
+        else:
+            self.blackPieces |= bit
+        self.occupied |= bit
+
+    def _clearSquare(self, r, c):
+        piece = self.board[r][c]
+        if piece == '--':
+            return
+        sq = r * 8 + c
+        bit = 1 << sq
+        index = PIECE_INDEX[piece]
+        self.board[r][c] = '--'
+        self.bitboards[index] ^= bit
+        self._zobristKey ^= ZOBRIST_PIECES[index][sq]
+        self.material -= PIECE_VALUE_SCORES[index]
+        self.positional -= PIECE_SQUARE_SCORES[index][sq]
+        if piece[0] == 'w':
+            self.whitePieces ^= bit
+        else:
+            self.blackPieces ^= bit
+        self.occupied ^= bit
 
     def makeMove(self, move: Move):
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        if move.enpassantMove:
+            # Remove the captured pawn, it sits beside the moving pawn
+            self._clearSquare(move.startRow, move.endCol)
+        else:
+            self._clearSquare(move.endRow, move.endCol)
+        self._clearSquare(move.startRow, move.startCol)
+        # Pawn promotion
+        if move.pawnPromotion:
+            self._putPiece(move.endRow, move.endCol, move.pieceMoved[0] + move.promotionChoice)
+        else:
+            self._putPiece(move.endRow, move.endCol, move.pieceMoved)
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove  # Switch turns
+        self._zobristKey ^= ZOBRIST_BLACK_TO_MOVE
         if move.pieceMoved == 'wK':
             self.whiteKingLocation = (move.endRow, move.endCol)
         elif move.pieceMoved == 'bK':
             self.blackKingLocation = (move.endRow, move.endCol)
 
-        # Pawn promotion
-        if move.pawnPromotion:
-            # promotedPiece = input('Promote to Q, R, B or N: ')
-            promotedPiece = 'Q'  # For simplicity, always promote to Queen
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + \
-                promotedPiece
-
         # En passant
+        if self.enpassantPossible != ():
+            self._zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
         if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
             self.enpassantPossible = (
                 (move.startRow + move.endRow) // 2, move.startCol)
-            print(f"En passant possible at: {self.enpassantPossible}")
+            if MAKEMOVE_TRACE.debug:
+                MAKEMOVE_TRACE.event(Trace.DEBUG, 'enpassant_possible', square=self.enpassantPossible)
+            self._zobristKey ^= ZOBRIST_ENPASSANT[move.startCol]
         else:
             self.enpassantPossible = ()
             # print('Resetting en passant possible')
-        if move.enpassantMove:
-            # print(f"En passant move: {move.endRow}, {move.endCol}")
-            # Remove the captured pawn
-            self.board[move.startRow][move.endCol] = '--'
+        self.enpassantPossibleLog.append(self.enpassantPossible)
 
         # Caslting
 
         if move.castleMove:
+            rook = move.pieceMoved[0] + 'R'
             if move.endCol - move.startCol == 2:  # King side castle
-                # Move rook to the left
-                self.board[move.endRow][move.endCol -
-                                        1] = move.pieceMoved[0] + 'R'
-                # Remove rook from the left
-                self.board[move.endRow][move.endCol + 1] = '--'
+                # Remove rook from the right corner
+                self._clearSquare(move.endRow, move.endCol + 1)
+                # Move rook to the left of the king
+                self._putPiece(move.endRow, move.endCol - 1, rook)
 
             else:  # queenside castle
-                # Move rook to the right
-                self.board[move.endRow][move.endCol +
-                                        1] = move.pieceMoved[0] + 'R'
-                # Remove rook from the right
-                self.board[move.endRow][move.endCol - 2] = '--'
+                # Remove rook from the left corner
+                self._clearSquare(move.endRow, move.endCol - 2)
+                # Move rook to the right of the king
+                self._putPiece(move.endRow, move.endCol + 1, rook)
+        self._zobristKey ^= castleRightsKey(self.currentCastleRights)
         self.updateCastleRights(move)
+        self._zobristKey ^= castleRightsKey(self.currentCastleRights)
         self.castleRightsLog.append(CastleRights(
             self.currentCastleRights.wks, self.currentCastleRights.wqs,
             # List to keep track of castle rights after each move
             self.currentCastleRights.bks, self.currentCastleRights.bqs))
-        
-        # 50-move rule UNDO NOT IMPLEMENTED
+
+        # 50-move rule
         self.drawMoveCounter += 1
         if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
             self.drawMoveCounter = 0
+        self.drawMoveCounterLog.append(self.drawMoveCounter)
+
+        self.zobristKeyLog.append(self._zobristKey)
+        if self.debugZobrist:
+            self.checkZobristKey()
 
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self._clearSquare(move.endRow, move.endCol)
+            self._putPiece(move.startRow, move.startCol, move.pieceMoved)
+            if move.enpassantMove:
+                # Put the captured pawn back beside the moving pawn
+                self._putPiece(move.startRow, move.endCol, move.pieceCaptured)
+            elif move.pieceCaptured != '--':
+                self._putPiece(move.endRow, move.endCol, move.pieceCaptured)
             self.whiteToMove = not self.whiteToMove
             if move.pieceMoved == 'wK':
                 self.whiteKingLocation = (move.startRow, move.startCol)
             elif move.pieceMoved == 'bK':
                 self.blackKingLocation = (move.startRow, move.startCol)
 
-            # Undo enpassant
-            if move.enpassantMove:
-                self.board[move.endRow][move.endCol] = '--'
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                # Restore en passant square
-                self.enpassantPossible = (move.endRow, move.endCol)
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+            # Restore en passant square
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
 
             if move.castleMove:
+                rook = move.pieceMoved[0] + 'R'
                 if move.endCol - move.startCol == 2:  # King side castle
-                    # Move rook back to the right
-                    self.board[move.endRow][move.endCol +
-                                            1] = move.pieceMoved[0] + 'R'
-                    # Remove rook from the left
-                    self.board[move.endRow][move.endCol-1] = '--'
+                    # Remove rook from the left of the king
+                    self._clearSquare(move.endRow, move.endCol - 1)
+                    # Move rook back to the right corner
+                    self._putPiece(move.endRow, move.endCol + 1, rook)
                 else:  # queenside castle
-                    # Move rook to left corner
-                    self.board[move.endRow][move.endCol -
-                                            2] = move.pieceMoved[0] + 'R'
-                    # Remove rook from left of king
-                    self.board[move.endRow][move.endCol+1] = '--'
+                    # Remove rook from the right of the king
+                    self._clearSquare(move.endRow, move.endCol + 1)
+                    # Move rook back to the left corner
+                    self._putPiece(move.endRow, move.endCol - 2, rook)
 
             # Castlerights
             self.castleRightsLog.pop()
-            self.currentCastleRights = copy.deepcopy(self.castleRightsLog[-1])
+            lastRights = self.castleRightsLog[-1]
+            self.currentCastleRights = CastleRights(
+                lastRights.wks, lastRights.wqs, lastRights.bks, lastRights.bqs)
 
             # 50-move rule
-            self.drawMoveCounter -= 1
+            self.drawMoveCounterLog.pop()
+            self.drawMoveCounter = self.drawMoveCounterLog[-1]
+
+            # Position key, the piece updates above already undid the squares
+            self.zobristKeyLog.pop()
+            self._zobristKey = self.zobristKeyLog[-1]
+            if self.debugZobrist:
+                self.checkZobristKey()
 
 
     def updateCastleRights(self, move):
@@ -263,108 +779,140 @@ class GameState:
     def checkForPinsAndChecks(self):
         pins = []
         checks = []
-        inCheck = False
 
         if self.whiteToMove:
-            enemy_color = 'b'
-            ally_color = 'w'
+            allies = self.whitePieces
+            enemy = 6
             startRow, startCol = self.whiteKingLocation
         else:
-            enemy_color = 'w'
-            ally_color = 'b'
+            allies = self.blackPieces
+            enemy = 0
             startRow, startCol = self.blackKingLocation
+        bb = self.bitboards
+        kingSq = startRow * 8 + startCol
+
+        # Enemy sliders that would hit the king on an empty board; with nothing in
+        # between they check it, with exactly one of our pieces in between it is pinned
+        snipers = (ROOK_RAYS[kingSq] & (bb[enemy + 3] | bb[enemy + 4])) | \
+            (BISHOP_RAYS[kingSq] & (bb[enemy + 2] | bb[enemy + 4]))
+        while snipers:
+            sq = bitScan(snipers)
+            snipers &= snipers - 1
+            blockers = BETWEEN[kingSq][sq] & self.occupied
+            r, c = sq >> 3, sq & 7
+            dir = ((r > startRow) - (r < startRow), (c > startCol) - (c < startCol))
+            if not blockers:
+                checks.append((r, c, dir[0], dir[1]))
+            elif blockers & (blockers - 1) == 0 and blockers & allies:
+                pinned = bitScan(blockers)
+                pins.append((pinned >> 3, pinned & 7, dir[0], dir[1]))
+
+        # Pawns and knights can't be blocked, only captured
+        checkers = (PAWN_ATTACKS[0 if self.whiteToMove else 1][kingSq] & bb[enemy]) | \
+            (KNIGHT_ATTACKS[kingSq] & bb[enemy + 1])
+        while checkers:
+            sq = bitScan(checkers)
+            checkers &= checkers - 1
+            checks.append((sq >> 3, sq & 7, (sq >> 3) - startRow, (sq & 7) - startCol))
+
+        return len(checks) > 0, pins, checks
+
+    def attackedSquares(self, white, occupied=None):
+        # Every square the given side attacks (defended pieces included)
+        if occupied is None:
+            occupied = self.occupied
+        bb = self.bitboards
+        first = 0 if white else 6
+        attacks = pawnAttacks(bb[first], white)  # All pawns at once
+        if bb[first + 5]:
+            attacks |= KING_ATTACKS[bitScan(bb[first + 5])]
+        knights = bb[first + 1]
+        while knights:
+            sq = bitScan(knights)
+            knights &= knights - 1
+            attacks |= KNIGHT_ATTACKS[sq]
+        diagonals = bb[first + 2] | bb[first + 4]
+        while diagonals:
+            sq = bitScan(diagonals)
+            diagonals &= diagonals - 1
+            attacks |= bishopAttacks(sq, occupied)
+        orthogonals = bb[first + 3] | bb[first + 4]
+        while orthogonals:
+            sq = bitScan(orthogonals)
+            orthogonals &= orthogonals - 1
+            attacks |= rookAttacks(sq, occupied)
+        return attacks
+
+    def kingDangerSquares(self):
+        # Squares the king to move can't step on. It is taken off the board so
+        # it does not shield the squares behind it from a checking slider
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return self.attackedSquares(not self.whiteToMove, self.occupied ^ squareBit(kingRow, kingCol))
+
+    def squareUnderAttack(self, r, c, occupied=None, captured=0):
+        # True if the side not to move attacks (r, c). `captured` removes enemy
+        # pieces that would be taken by the move being tested
+        sq = r * 8 + c
+        if occupied is None:
+            occupied = self.occupied
+        bb = self.bitboards
+        enemy = 6 if self.whiteToMove else 0
+        remaining = ~captured
+        if PAWN_ATTACKS[0 if self.whiteToMove else 1][sq] & bb[enemy] & remaining:
+            return True
+        if KNIGHT_ATTACKS[sq] & bb[enemy + 1] & remaining:
+            return True
+        if KING_ATTACKS[sq] & bb[enemy + 5]:
+            return True
+        if bishopAttacks(sq, occupied) & (bb[enemy + 2] | bb[enemy + 4]) & remaining:
+            return True
+        if rookAttacks(sq, occupied) & (bb[enemy + 3] | bb[enemy + 4]) & remaining:
+            return True
+        return False
 
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1),
-                      # Vertical, Horizontal, Diagonal
-                      (-1, 1), (1, -1), (1, 1))
-        for j, dir in enumerate(directions):
-            possiblePin = ()
-            for i in range(1, len(self.board[0])):
-                endRow = startRow + dir[0] * i
-                endCol = startCol + dir[1] * i
-                if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == ally_color and endPiece[1] != 'K':
-                        if possiblePin == ():
-                            possiblePin = (endRow, endCol, dir[0], dir[1])
-                        else:  # second ally, no pin or check possible in this direction
-                            break
-
-                    # 1) vertical or horizontal an its a rook
-                    # 2) diagonal and its a bishop
-                    # 3) 1 sq diagonal and its a pawn
-                    # 4) any direction and queen
-                    # 5) 1 sq in any direction and king
-                    elif endPiece[0] == enemy_color:  # Enemy piece
-                        pieceType = endPiece[1]
-                        if (0 <= j <= 3 and pieceType == 'R') or \
-                            (4 <= j <= 7 and pieceType == 'B') or \
-                            (i == 1 and pieceType == 'p' and ((enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
-                            (pieceType == 'Q') or \
-                                (i == 1 and pieceType == 'K'):
-
-                            if possiblePin == ():  # no blocks, so its check
-                                inCheck = True
-                                checks.append((endRow, endCol, dir[0], dir[1]))
-                                break
-                            else:  # piece blocking, so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # enemy piece but not a check
-                            break
-                else:  # out of bounds
-                    break
-        knightMoves = ((-2, -1), (-1, -2), (1, -2), (2, -1),
-                       (2, 1), (1, 2), (-1, 2), (-2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemy_color and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
-
-        return inCheck, pins, checks
+    def _legalMasks(self, kingRow, kingCol, pins, checks):
+        # checkMask: squares that resolve a single check (everything when not in check)
+        # pinMasks: square -> line through king and pinner a pinned piece may still move along
+        kingSq = kingRow * 8 + kingCol
+        pinMasks = {}
+        for pin in pins:
+            pinMasks[pin[0] * 8 + pin[1]] = LINE[kingSq][pin[0] * 8 + pin[1]]
+        checkMask = FULL_BOARD
+        if len(checks) == 1:  # Single check, capture the checker or block (BETWEEN is empty for knights and pawns)
+            checkerSq = checks[0][0] * 8 + checks[0][1]
+            checkMask = BETWEEN[kingSq][checkerSq] | (1 << checkerSq)
+        elif len(checks) > 1:  # Double check, only the king can move
+            checkMask = 0
+        return checkMask, pinMasks
 
     def getValidMoves(self):
+        # A cache hit restores inCheck and the end-of-game flags, not the pin and check details
+        cache = self.moveCache
+        if cache is not None:
+            entry = cache.get(self._zobristKey)
+            if entry is not None:
+                moves, self.inCheck = entry
+                self.checkmate = not moves and self.inCheck
+                self.stalemate = not self.checkmate and (not moves or self.drawMoveCounter >= 100)
+                return list(moves)
+
         moves = []
+        self.checkmate = False
+        self.stalemate = False
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
             kingRow, kingCol = self.whiteKingLocation
         else:
             kingRow, kingCol = self.blackKingLocation
+        self.checkMask, self.pinMasks = self._legalMasks(kingRow, kingCol, self.pins, self.checks)
+        self.kingDanger = self.kingDangerSquares()  # One attack map for king moves and castling
 
-        if self.inCheck:
-            if len(self.checks) == 1:  # Single check, block or move king
-                moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow, checkCol = check[0], check[1]
-                checkDir = (check[2], check[3])  # Direction of the check
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []  # Squares where the king can move to escape check
-                if pieceChecking[1] == 'N':  # Knight check, cant block
-                    # Knight can be captured
-                    validSquares = [(checkRow, checkCol)]
-                else:  # Rook, Bishop, Queen or King check
-                    for i in range(1, len(self.board[0])):
-                        validSquare = (
-                            kingRow + checkDir[0] * i, kingCol + checkDir[1] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-                # remove moves that don't block or move the king
-                # go backwards when removing from list
-                for i in range(len(moves) - 1, -1, -1):
-                    # does not move king, so must block or capture
-                    if moves[i].pieceMoved[1] != 'K':
-                        # move does not block or captures
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else:  # Double check, must move king
-                self.getKingMoves(kingRow, kingCol, moves)
-        else:  # Not in check, get all possible moves
+        if self.inCheck and len(self.checks) > 1:  # Double check, must move king
+            self.getKingMoves(kingRow, kingCol, moves)
+        else:  # Single check is handled by the check mask
             moves = self.getAllPossibleMoves()
+        if cache is not None:
+            cache.put(self._zobristKey, moves, self.inCheck)
 
         # Updates engame flags
         if len(moves) == 0:
@@ -372,261 +920,259 @@ class GameState:
                 self.checkmate = True
                 return moves
             self.stalemate = True
-        
+
         if self.drawMoveCounter >= 100:
             self.stalemate = True
 
         return moves
 
+    def getValidMoveCodes(self):
+        # Legal moves as packed 16-bit ints, for tables and sending between processes
+        return array('H', [move.packed for move in self.getValidMoves()])
+
+    def generateMoves(self, hashMove=None, quiets=True):
+        """
+        Yields the legal moves lazily, in stages: hashMove (if it is legal
+        here), captures (MVV-LVA order), promotions, then quiet moves unless
+        quiets is False. Each stage is only generated when the consumer asks
+        for a move past the previous one, so a search that cuts off early
+        skips most of the work.
+        The consumer may make/undo moves between items as long as the
+        position is restored before asking for the next one. Unlike
+        getValidMoves this does not set checkmate/stalemate.
+        """
+        inCheck, pins, checks = self.checkForPinsAndChecks()
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+            first = 0
+            enemies = self.blackPieces
+            promotionRow = ROWS[0]
+        else:
+            kingRow, kingCol = self.blackKingLocation
+            first = 6
+            enemies = self.whitePieces
+            promotionRow = ROWS[7]
+        checkMask, pinMasks = self._legalMasks(kingRow, kingCol, pins, checks)
+        danger = self.kingDangerSquares()
+
+        # Target masks are cheap, Move objects and king safety are what stages defer
+        pieces = []
+        for i in range(6):
+            pieceType = PIECES[first + i][1]
+            squares = self.bitboards[first + i]
+            while squares:
+                sq = bitScan(squares)
+                squares &= squares - 1
+                pieces.append((sq >> 3, sq & 7, pieceType,
+                               self._pieceTargets(sq >> 3, sq & 7, pieceType, checkMask, pinMasks)))
+
+        skip = None
+        if hashMove is not None:
+            for r, c, pieceType, targets in pieces:
+                if (r, c) == (hashMove.startRow, hashMove.startCol):
+                    candidates = []
+                    self._addPieceMoves(r, c, pieceType, targets, candidates, inCheck, danger)
+                    for move in candidates:
+                        if move == hashMove:
+                            skip = move
+                            yield move
+                    break
+
+        # Captures (promotions wait for their own stage)
+        moves = []
+        for r, c, pieceType, targets in pieces:
+            captures = targets & enemies
+            if pieceType == 'K':
+                captures &= ~danger
+            elif pieceType == 'p':
+                captures &= ~promotionRow
+                self._addEnpassantMove(r, c, moves)
+            self._addMoves(r, c, captures, moves)
+        moves.sort(key=lambda move: CAPTURE_ORDER[move.pieceMoved[1]] - 8 * CAPTURE_ORDER[move.pieceCaptured[1]])
+        for move in moves:
+            if move != skip:
+                yield move
+
+        # Promotions, capturing or not
+        for r, c, pieceType, targets in pieces:
+            if pieceType == 'p' and targets & promotionRow:
+                moves = []
+                self._addPawnMoves(r, c, targets & promotionRow, moves)
+                for move in moves:
+                    if move != skip:
+                        yield move
+
+        if not quiets:
+            return
+        # Quiet moves and castling
+        empty = ~self.occupied
+        for r, c, pieceType, targets in pieces:
+            moves = []
+            quiets = targets & empty
+            if pieceType == 'K':
+                self._addMoves(r, c, quiets & ~danger, moves)
+                self.getCastleMoves(r, c, moves, inCheck, danger)
+            else:
+                if pieceType == 'p':
+                    quiets &= ~promotionRow
+                self._addMoves(r, c, quiets, moves)
+            for move in moves:
+                if move != skip:
+                    yield move
+
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)):  # Rows
-            for c in range(len(self.board[r])):  # Columns in curr row
-                color_turn = self.board[r][c][0]  # Get the color of the piece
-                if (color_turn == 'w' and self.whiteToMove) or (color_turn == 'b' and not self.whiteToMove):
-                    piece_type = self.board[r][c][1]
-                    # print('PIECE:', piece_type)
-                    if piece_type == 'p':
-                        self.getPawnMoves(r, c, moves)
-                    elif piece_type == 'R':
-                        self.getRookMoves(r, c, moves)
-                    elif piece_type == 'N':
-                        self.getKnightMoves(r, c, moves)
-                    elif piece_type == 'B':
-                        self.getBishopMoves(r, c, moves)
-                    elif piece_type == 'Q':
-                        self.getQueenMoves(r, c, moves)
-                    elif piece_type == 'K':
-                        self.getKingMoves(r, c, moves)
+        first = 0 if self.whiteToMove else 6
+        generators = (self.getPawnMoves, self.getKnightMoves, self.getBishopMoves,
+                      self.getRookMoves, self.getQueenMoves, self.getKingMoves)
+        for i, generator in enumerate(generators):
+            pieces = self.bitboards[first + i]
+            while pieces:
+                sq = bitScan(pieces)
+                pieces &= pieces - 1
+                generator(sq >> 3, sq & 7, moves)
         return moves
 
-    def getPawnMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        pawnPromotion = False
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])  # Remove the pin from the list
-                break
-
-        if self.whiteToMove:
-            enemy_color = 'b'
-            move_dir = -1
-            endrow = 0
-            startrow = 6
+    def _pieceTargets(self, r, c, pieceType, checkMask, pinMasks):
+        # Legal destination squares, except that king squares are not yet
+        # checked against the danger map and en passant/castling are handled separately
+        sq = r * 8 + c
+        allies = self.whitePieces if self.whiteToMove else self.blackPieces
+        if pieceType == 'K':
+            return KING_ATTACKS[sq] & ~allies
+        if pieceType == 'p':
+            empty = ~self.occupied
+            if self.whiteToMove:
+                targets = (1 << sq) >> 8 & empty  # 1 sq move
+                if targets and r == 6:
+                    targets |= targets >> 8 & empty  # 2 sq move
+                targets |= PAWN_ATTACKS[0][sq] & self.blackPieces  # Enemy piece capture
+            else:
+                targets = (1 << sq) << 8 & empty
+                if targets and r == 1:
+                    targets |= targets << 8 & empty
+                targets |= PAWN_ATTACKS[1][sq] & self.whitePieces
+        elif pieceType == 'N':
+            if sq in pinMasks:  # A pinned knight can never stay on the pin line
+                return 0
+            targets = KNIGHT_ATTACKS[sq] & ~allies  # Not ally = empty or enemy
+        elif pieceType == 'B':
+            targets = bishopAttacks(sq, self.occupied) & ~allies
+        elif pieceType == 'R':
+            targets = rookAttacks(sq, self.occupied) & ~allies
         else:
-            enemy_color = 'w'
-            move_dir = 1
-            endrow = 7
-            startrow = 1
-
-        print('PAWN CHECKING')
-        if self.board[r+move_dir][c] == '--':  # 1 sq move
-            # Not pinned or pinned in the same direction
-            if not piecePinned or pinDirection == (move_dir, 0):
-                if r+move_dir == endrow:
-                    pawnPromotion = True
-                    print("Pawn promotion!", pawnPromotion)
-                moves.append(Move((r, c), (r+move_dir, c),
-                             self.board, pawnPromotion=pawnPromotion))
-                if r == startrow and self.board[r+2*move_dir][c] == '--':
-                    moves.append(Move((r, c), (r+2*move_dir, c), self.board))
-
-        for capture_col_dir in [-1, 1]:
-            if 0 <= c+capture_col_dir < len(self.board[r]):  # captures to left
-                # Enemy piece capture
-                if self.board[r+move_dir][c+capture_col_dir][0] == enemy_color:
-                    if not piecePinned or pinDirection == (move_dir, -1):
-                        if r+move_dir == endrow:
-                            pawnPromotion = True
-                            print("Capture Pawn promotion!", pawnPromotion)
-                        moves.append(Move(
-                            (r, c), (r+move_dir, c+capture_col_dir), self.board, pawnPromotion=pawnPromotion))
-                elif (r+move_dir, c-1) == self.enpassantPossible:
-                    moves.append(
-                        Move((r, c), (r+move_dir, c+capture_col_dir), self.board, enpassantMove=True))
+            targets = (bishopAttacks(sq, self.occupied) | rookAttacks(sq, self.occupied)) & ~allies
+        targets &= checkMask
+        pinMask = pinMasks.get(sq)
+        if pinMask is not None:
+            targets &= pinMask
+        return targets
+
+    def _addPieceMoves(self, r, c, pieceType, targets, moves, inCheck, danger):
+        if pieceType == 'p':
+            self._addPawnMoves(r, c, targets, moves)
+            self._addEnpassantMove(r, c, moves)
+        elif pieceType == 'K':
+            self._addMoves(r, c, targets & ~danger, moves)
+            self.getCastleMoves(r, c, moves, inCheck, danger)
+        else:
+            self._addMoves(r, c, targets, moves)
+
+    def _addMoves(self, r, c, targets, moves):
+        while targets:
+            sq = bitScan(targets)
+            targets &= targets - 1
+            moves.append(Move((r, c), (sq >> 3, sq & 7), self.board))
+
+    def _addPawnMoves(self, r, c, targets, moves):
+        if r + (-1 if self.whiteToMove else 1) in (0, 7):
+            if targets and MOVEGEN_TRACE.debug:
+                MOVEGEN_TRACE.event(Trace.DEBUG, 'pawn_promotion', row=r, col=c)
+            while targets:
+                sq = bitScan(targets)
+                targets &= targets - 1
+                for choice in PROMOTION_CHOICES:
+                    moves.append(Move((r, c), (sq >> 3, sq & 7), self.board,
+                                      pawnPromotion=True, promotionChoice=choice))
+        else:
+            self._addMoves(r, c, targets, moves)
+
+    def _addEnpassantMove(self, r, c, moves):
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            if PAWN_ATTACKS[0 if self.whiteToMove else 1][r * 8 + c] & squareBit(epRow, epCol) and self.enpassantIsLegal(r, c, epCol):
+                moves.append(
+                    Move((r, c), (epRow, epCol), self.board, enpassantMove=True))
+
+    def getPawnMoves(self, r, c, moves):
+        if MOVEGEN_TRACE.debug:
+            MOVEGEN_TRACE.event(Trace.DEBUG, 'pawn_moves', row=r, col=c)
+        self._addPawnMoves(r, c, self._pieceTargets(r, c, 'p', self.checkMask, self.pinMasks), moves)
+        self._addEnpassantMove(r, c, moves)
+
+    def enpassantIsLegal(self, r, c, epCol):
+        # En passant removes two pawns from one row, so neither pins nor the
+        # check mask cover it; replay the occupancy and test the king directly
+        capturedBit = squareBit(r, epCol)
+        occupied = (self.occupied ^ squareBit(r, c) ^ capturedBit) | squareBit(r + (-1 if self.whiteToMove else 1), epCol)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return not self.squareUnderAttack(kingRow, kingCol, occupied, captured=capturedBit)
 
     def getRookMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            # Check if piece im looking is pinned
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q':  # Cant remove queen pin on rook moves
-                    self.pins.remove(self.pins[i])
-                break
-        enemy_color = 'b' if self.whiteToMove else 'w'
-
-        for dir in ((-1, 0), (1, 0), (0, -1), (0, 1)):  # Up, Down, Left, Right
-            # Check up to 7 squares in each direction
-            for i in range(1, len(self.board[0])):
-                endRow = r + dir[0] * i
-                endCol = c + dir[1] * i
-                # print(f"Checking Rook move from {r, c} to {new_pos}")
-                # on board
-                if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                    # Not pinned or movin while maintaining pin
-                    if not piecePinned or pinDirection == dir or pinDirection == (-dir[0], -dir[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--':  # Empty square
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy_color:  # Same color piece
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
-                            break  # Stop if we hit an enemy piece
-                        else:  # Same color piece
-                            break
-                else:
-                    # print("Out of bounds")
-                    break
+        self._addMoves(r, c, self._pieceTargets(r, c, 'R', self.checkMask, self.pinMasks), moves)
 
     def getKnightMoves(self, r, c, moves):
-        piecePinned = False
-        knight_moves = ((-2, -1), (-1, -2), (1, -2), (2, -1),
-                        (2, 1), (1, 2), (-1, 2), (-2, 1))
-        ally_color = 'w' if self.whiteToMove else 'b'
-
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                self.pins.remove(self.pins[i])  # Remove the pin from the list
-                break
-
-        for m in knight_moves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != ally_color:  # Not ally = empty or enemy
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
+        self._addMoves(r, c, self._pieceTargets(r, c, 'N', self.checkMask, self.pinMasks), moves)
 
     def getBishopMoves(self, r, c, moves):
-
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            # Check if piece im looking is pinned
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        enemy_color = 'b' if self.whiteToMove else 'w'
-
-        # Up-Left, Up-Right, Down-Left, Down-Right
-        for dir in ((-1, -1), (-1, 1), (1, -1), (1, 1)):
-            # Check up to 7 squares in each direction
-            for i in range(1, len(self.board[0])):
-                endRow = r + dir[0] * i
-                endCol = c + dir[1] * i
-                # print(f"Checking bishop move from {r, c} to {endRow, endCol}")
-                if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                    # Not pinned or movin while maintaining pin
-                    if not piecePinned or pinDirection == dir or pinDirection == (-dir[0], -dir[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--':  # Empty square
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy_color:  # Same color piece
-                            moves.append(
-                                Move((r, c), (endRow, endCol), self.board))
-                            break  # Stop if we hit an enemy piece
-                        else:  # Same color piece
-                            break
-                else:
-                    # print("Out of bounds")
-                    break
+        self._addMoves(r, c, self._pieceTargets(r, c, 'B', self.checkMask, self.pinMasks), moves)
 
     def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
+        self._addMoves(r, c, self._pieceTargets(r, c, 'Q', self.checkMask, self.pinMasks), moves)
 
     def getKingMoves(self, r, c, moves):
-        ally_color = 'w' if self.whiteToMove else 'b'
-        king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
-                      (0, 1), (1, -1), (1, 0), (1, 1))
-
-        for m in king_moves:
-            # new_pos = (r + m[0], c + m[1])
-            endRow = r + m[0]
-            endCol = c + m[1]
-            # print(f"Checking king move from {r, c} to {endRow, endCol}")
-
-            # Check if inside the board
-            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board[0]):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != ally_color:
-                    # Temporarily move the king to check for checks
-                    if ally_color == 'w':
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-
-                    if not inCheck:  # If the move does not put the king in check
-                        moves.append(
-                            Move((r, c), (endRow, endCol), self.board))
-
-                    # Reset king location
-                    if ally_color == 'w':
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        targets = self._pieceTargets(r, c, 'K', self.checkMask, self.pinMasks)
+        self._addMoves(r, c, targets & ~self.kingDanger, moves)
         self.getCastleMoves(r, c, moves)  # Check for castling moves
 
-    def getCastleMoves(self, r, c, moves):
-        if self.inCheck:
+    def getCastleMoves(self, r, c, moves, inCheck=None, danger=None):
+        # inCheck/danger let callers that don't go through getValidMoves pass their own
+        if self.inCheck if inCheck is None else inCheck:
             return
+        if danger is None:
+            danger = self.kingDanger
 
         if (self.whiteToMove and self.currentCastleRights.wks) or (not self.whiteToMove and self.currentCastleRights.bks):
-            self.getKingSideCastleMoves(r, c, moves)
+            self.getKingSideCastleMoves(r, c, moves, danger)
         if (self.whiteToMove and self.currentCastleRights.wqs) or (not self.whiteToMove and self.currentCastleRights.bqs):
-            print('HAVE QUEEN SIDE CASTLE RIGHTS')
-            self.getQueenSideCastleMoves(r, c, moves)
+            if MOVEGEN_TRACE.debug:
+                MOVEGEN_TRACE.event(Trace.DEBUG, 'queenside_castle_rights', row=r, col=c)
+            self.getQueenSideCastleMoves(r, c, moves, danger)
 
-    def getKingSideCastleMoves(self, r, c, moves):
-        print('GETTING KING SIDE CASTLE MOVES', r, c)
+    def getKingSideCastleMoves(self, r, c, moves, danger):
+        if MOVEGEN_TRACE.debug:
+            MOVEGEN_TRACE.event(Trace.DEBUG, 'kingside_castle_moves', row=r, col=c)
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
-            # Temporarily switch to opponent's turn
-            self.whiteToMove = not self.whiteToMove
-            for check_square in [(r, c+1), (r, c+2)]:
-                inCheck, pins, checks = self.checkForPinsAndChecks()
-                if check_square in checks:
-                    # Switch back if loop ends early anyway
-                    self.whiteToMove = not self.whiteToMove
-                    return
-            self.whiteToMove = not self.whiteToMove  # Switch back to original turn
-            moves.append(Move((r, c), (r, c+2), self.board, castleMove=True))
-
-    def getQueenSideCastleMoves(self, r, c, moves):
+            # King may not pass through or land on an attacked square
+            if not danger & (squareBit(r, c+1) | squareBit(r, c+2)):
+                moves.append(Move((r, c), (r, c+2), self.board, castleMove=True))
+
+    def getQueenSideCastleMoves(self, r, c, moves, danger):
         if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
-            # Temporarily switch to opponent's turn
-            self.whiteToMove = not self.whiteToMove
-            for check_square in [(r, c-1), (r, c-2)]:
-                inCheck, pins, checks = self.checkForPinsAndChecks()
-                if check_square in checks:
-                    # Switch back if loop ends early anyway
-                    self.whiteToMove = not self.whiteToMove
-                    return
-            self.whiteToMove = not self.whiteToMove  # Switch back to original turn
-            moves.append(Move((r, c), (r, c-2), self.board, castleMove=True))
+            # King may not pass through or land on an attacked square
+            if not danger & (squareBit(r, c-1) | squareBit(r, c-2)):
+                moves.append(Move((r, c), (r, c-2), self.board, castleMove=True))
 
-    def encodeGamestate(self):
-        piece_to_int = {
-            '--': 0,
-            'wp': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
-            'bp': -1, 'bN': -2, 'bB': -3, 'bR': -4, 'bQ': -5, 'bK': -6
-        }
+    # Piece codes for encodeGamestate, see Encoder.encode_positions for batches
+    pieceToInt = {
+        '--': 0,
+        'wp': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+        'bp': -1, 'bN': -2, 'bB': -3, 'bR': -4, 'bQ': -5, 'bK': -6
+    }
 
-        return [[piece_to_int[square] for square in row] for row in self.board]
+    def encodeGamestate(self):
+        pieceToInt = self.pieceToInt
+        return [[pieceToInt[square] for square in row] for row in self.board]
 
     def getValueAndTerminated(self):
         self.getValidMoves()
@@ -634,7 +1180,7 @@ class GameState:
             return 1, True
         elif self.stalemate:
             return 0, True
-        return 0, False 
-    
+        return 0, False
+
     def getOpponentValue(self, value):
         return - value
@@ -4,6 +4,8 @@ import ChessAI
 import random
 import AlphaShrimp
 import numpy as np
+from BackgroundSearch import BackgroundSearch
+from Search import SearchLimits
 np.random.seed(2)
 # 0 - 40
 
@@ -11,8 +13,12 @@ WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 60  # For animations
+AI_MOVETIME = 5.0  # Seconds the engine thinks per move
+PONDER = True  # Keep searching the expected reply while the human thinks
 IMAGES = {}
 COLORS = [p.Color("white"), p.Color("gray")]
+BOARD_SURFACE = None  # Empty board, rendered once by board_surface()
+HIGHLIGHTS = {}  # 'selected'/'target' -> translucent square overlay
 
 def load_images():
     pieces = ['bK', 'bN', 'bB', 'bR', 'bQ', 'bp','wK', 'wN', 'wB', 'wR', 'wQ', 'wp']
@@ -28,6 +34,20 @@ def draw_board(screen):
             color = COLORS[((r + c) % 2)]
             p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
+def board_surface():
+    global BOARD_SURFACE
+    if BOARD_SURFACE is None:
+        BOARD_SURFACE = p.Surface((WIDTH, HEIGHT))
+        draw_board(BOARD_SURFACE)
+    return BOARD_SURFACE
+
+def load_highlights():
+    for name, color, alpha in (('selected', 'blue', 85), ('target', 'yellow', 50)):
+        s = p.Surface((SQ_SIZE, SQ_SIZE))
+        s.set_alpha(alpha)  # Set transparency
+        s.fill(p.Color(color))
+        HIGHLIGHTS[name] = s
+
 def draw_pieces(screen, board):
     for r in range(DIMENSION):
         for c in range(DIMENSION):
@@ -35,24 +55,55 @@ def draw_pieces(screen, board):
             if piece != '--':  # If there is a piece at this square
                 screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-def highlight_squares(screen, gs, valid_moves, sq_selected):
+def highlight_squares(gs, valid_moves, sq_selected):
+    # (row, col) -> highlight name
+    highlights = {}
     if sq_selected != ():
         r, c = sq_selected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):  # Highlight only if the selected square has the player's piece
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(85)  # Set transparency
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            s.set_alpha(50)  # Set transparency
-            s.fill(p.Color('yellow'))
             for move in valid_moves:
                 if move.startRow == r and move.startCol == c:  # Highlight valid moves from the selected square
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+                    highlights[(move.endRow, move.endCol)] = 'target'
+            highlights[(r, c)] = 'selected'
+    return highlights
+
+def square_rect(r, c):
+    return p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+
+class BoardRenderer:
+    """
+    Draws the game state onto the screen square by square, and only the
+    squares whose piece or highlight changed since the last call. render()
+    returns those squares' rects for display.update, so an idle frame draws
+    and uploads nothing.
+    """
+    def __init__(self):
+        self.squares = [None] * (DIMENSION * DIMENSION)  # Last drawn (piece, highlight), None = redraw
+
+    def invalidate(self):
+        # Redraw everything on the next render, after something else drew on the screen
+        self.squares = [None] * (DIMENSION * DIMENSION)
+
+    def render(self, screen, gs, valid_moves, sq_selected):
+        highlights = highlight_squares(gs, valid_moves, sq_selected)
+        dirty = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                look = (gs.board[r][c], highlights.get((r, c)))
+                if self.squares[r * DIMENSION + c] != look:
+                    self.squares[r * DIMENSION + c] = look
+                    dirty.append(self.draw_square(screen, r, c, *look))
+        return dirty
 
-def draw_gamestate(screen, gs, valid_moves, sq_selected):
-    draw_board(screen)
-    highlight_squares(screen, gs, valid_moves, sq_selected)
-    draw_pieces(screen, gs.board)
+    def draw_square(self, screen, r, c, piece, highlight):
+        rect = square_rect(r, c)
+        screen.blit(board_surface(), rect, rect)
+        if highlight is not None:
+            screen.blit(HIGHLIGHTS[highlight], rect)
+        if piece != '--':  # If there is a piece at this square
+            screen.blit(IMAGES[piece], rect)
+        return rect
 
 
 def animate_move(move, screen, board, clock):
@@ -60,19 +111,28 @@ def animate_move(move, screen, board, clock):
     dc = move.endCol - move.startCol
     framesPerSquare = 5  # Number of frames to animate each square
     frameCount = (abs(dr) + abs(dc)) * framesPerSquare
+    # Everything but the moving piece stays put, draw it once: the board after
+    # the move with the end square still showing the captured piece
+    background = board_surface().copy()
+    draw_pieces(background, board)
+    endSquare = square_rect(move.endRow, move.endCol)
+    background.blit(board_surface(), endSquare, endSquare)  # Erase end piece
+    if move.pieceCaptured != '--':  # If there is a captured piece
+        background.blit(IMAGES[move.pieceCaptured], endSquare)
+    screen.blit(background, (0, 0))
+    p.display.update()
+    previous = None
     for frame in range(frameCount + 1):
         r, c = (move.startRow + dr*frame/frameCount, move.startCol+dc * frame/frameCount)
-        draw_board(screen)
-        draw_pieces(screen, board)
-        # Erase end piece
-        color = COLORS[((move.endRow + move.endCol) % 2)]
-        endSquare = p.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        if move.pieceCaptured != '--':  # If there is a captured piece
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
+        sprite = p.Rect(round(c * SQ_SIZE), round(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        dirty = [sprite]
+        if previous is not None:
+            screen.blit(background, previous, previous)  # Restore where the piece was last frame
+            dirty.append(previous)
         # Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()  # Update the display
+        screen.blit(IMAGES[move.pieceMoved], sprite)
+        p.display.update(dirty)  # Only the two rects the piece touched
+        previous = sprite
         clock.tick(MAX_FPS)  # Control the frame rate
 
 def drawText(text, screen):
@@ -80,8 +140,8 @@ def drawText(text, screen):
     textObject = font.render(text, 0, p.Color('Black'))
     textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - textObject.get_width() / 2, HEIGHT / 2 - textObject.get_height() / 2)
     screen.blit(textObject, textLocation)
-    p.display.flip()
     # p.time.wait(2000)  # Wait for 2 seconds before continuing
+    return textLocation  # For display.update
 
 def pygame_main():
     p.init()
@@ -95,6 +155,10 @@ def pygame_main():
     animate = False
     game_over = False
     load_images()
+    load_highlights()
+    renderer = BoardRenderer()
+    caption = None
+    message = None  # Game over text currently on screen
     # print(gs.board)
     running = True
     sq_selected = ()  # No square is selected initially
@@ -102,6 +166,10 @@ def pygame_main():
     
     playerOne = True  # True if human playing white, False if AI playing white
     playerTwo = True  # True if human playing black, False if AI playing black
+    # Searches on its own thread and keeps its tree between AI turns, see AlphaShrimp.PersistentMCTS
+    progress = {'searches': 0}
+    engine = BackgroundSearch({'C': 1.4, 'num_searches': 1000},
+                              on_progress=lambda mcts: progress.update(searches=mcts.searches_done))
 
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -127,6 +195,8 @@ def pygame_main():
                             if move == valid_moves[i]:
                                 gs.makeMove(valid_moves[i])  # Make the move in the game state
                                 print(f"Move made: {move.getChessNotation()}")
+                                if engine.opponent_moved(valid_moves[i], SearchLimits(movetime=AI_MOVETIME)):
+                                    print("Ponder hit")
                                 move_made = True
                                 animate = False
                                 sq_selected = () # reset clicks
@@ -136,11 +206,14 @@ def pygame_main():
             
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:
+                    engine.stop()
                     gs.undoMove()
                     move_made = True
                     animate = False
                 if e.key == p.K_r:
                     gs = ChessEngine.GameState()
+                    engine.new_game()
+                    game_over = False
                     valid_moves = gs.getValidMoves()
                     sq_selected = ()
                     player_clicks = []
@@ -148,44 +221,61 @@ def pygame_main():
                     animate = False
 
         if not game_over and not humanTurn: # AI turn
-            MCTS = AlphaShrimp.MCTS(gs, {'C': 1.4, 'num_searches': 1000})
-            possible_actions, action_probs = MCTS.search()
-            print(possible_actions)
-            print(action_probs)
-            # best_move = ChessAI.findBestMove(gs, gs.whiteToMove, depth = 3)
-            best_move = random.choice(valid_moves) if valid_moves else None
-            print(f"AI Move created: {best_move.getChessNotation()}")
-            if best_move is not None:
-                gs.makeMove(best_move)
-                print(f"AI Move made: {best_move.getChessNotation()}")
-                move_made = True
-                animate = False
+            # The search runs on the engine thread, this loop keeps drawing until it's done
+            if engine.idle():
+                progress['searches'] = 0
+                engine.start(gs, SearchLimits(movetime=AI_MOVETIME))
+            result = engine.poll()
+            if result is not None:
+                print(result)
+                # best_move = ChessAI.findBestMove(gs, gs.whiteToMove, depth = 3)
+                best_move = result.best_move
+                if best_move is not None:
+                    gs.makeMove(best_move)
+                    print(f"AI Move made: {best_move.getChessNotation()}")
+                    move_made = True
+                    animate = False
+                    if PONDER and ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)):
+                        engine.ponder(gs, best_move)
+        new_caption = (f"StockShrimp - thinking ({progress['searches']} playouts)" if engine.busy() and engine.ponder_move is None
+                       else "StockShrimp")
+        if new_caption != caption:
+            caption = new_caption
+            p.display.set_caption(caption)
             
 
         if move_made: # only calcualtes possible moves when clicks
             print("Move made, recalculating valid moves")
             if animate:
                 animate_move(gs.moveLog[-1], screen, gs.board, clock)
+                renderer.invalidate()
             valid_moves = gs.getValidMoves()
             print(valid_moves)
             move_made = False
             animate = False
 
-        
-        draw_gamestate(screen, gs, valid_moves, sq_selected)
-        
+        new_message = None
         if gs.checkmate:
             game_over = True
             if gs.whiteToMove:
-                drawText('Black wins by checkmate!', screen)
+                new_message = 'Black wins by checkmate!'
             else:
-                drawText('White wins by checkmate!', screen)
+                new_message = 'White wins by checkmate!'
         elif gs.stalemate:
             game_over = True
-            drawText('Stalemate!', screen)
+            new_message = 'Stalemate!'
+        if new_message != message:
+            renderer.invalidate()  # Clears the old text off the board
+            message = new_message
+
+        dirty = renderer.render(screen, gs, valid_moves, sq_selected)
+        if dirty and message is not None:
+            dirty.append(drawText(message, screen))  # Squares under the text were redrawn
 
+        if dirty:
+            p.display.update(dirty)  # Update only what changed
         clock.tick(MAX_FPS)
-        p.display.flip()  # Update the display
+    engine.stop()
 
 def print_board(board):
     for row in board:
@@ -197,6 +287,7 @@ def main():
     game_over = False
     playerOne = True  # True if human playing white, False if AI playing white
     playerTwo = False
+    mcts = AlphaShrimp.PersistentMCTS(gs, {'C': 1.4, 'num_searches': 1000})
     
     while not game_over:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -224,8 +315,7 @@ def main():
         else:
             # AI plays if playerOne or playerTwo is False
             # best_move = random.choice(valid_moves) if valid_moves else None
-            MCTS = AlphaShrimp.MCTS(gs, {'C': 1.4, 'num_searches': 1000})
-            possible_actions, action_probs = MCTS.search()
+            possible_actions, action_probs = mcts.search()
             print(possible_actions)
             print(action_probs)
             best_move = possible_actions[np.argmax(action_probs)] if possible_actions else None
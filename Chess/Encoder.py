@@ -0,0 +1,79 @@
+import ChessEngine
+import numpy as np
+
+# Input planes, one 8x8 plane each
+PIECE_PLANES = len(ChessEngine.PIECES)  # 0-11: one per piece, same order as GameState.bitboards
+SIDE_PLANE = 12  # All ones when white is to move
+CASTLE_PLANES = 13  # 13-16: wks, wqs, bks, bqs, all ones while the right is kept
+ENPASSANT_PLANE = 17  # The en passant target square, if any
+NUM_PLANES = 18
+
+# Policy slots: from square | to square << 6 (Move.packed without the kind
+# bits), underpromotions share the slot of the queen promotion
+POLICY_SIZE = 4096
+
+
+def encode_positions(gamestates, out=None):
+    """
+    Writes the planes of every GameState into out[:N], an (N, NUM_PLANES, 8, 8)
+    array of any numeric dtype, and returns that slice. Piece planes are
+    unpacked straight from the bitboards, no per-square Python work.
+    """
+    n = len(gamestates)
+    if out is None:
+        out = np.zeros((n, NUM_PLANES, 8, 8), dtype=np.float32)
+    elif out.ndim != 4 or out.shape[0] < n or out.shape[1:] != (NUM_PLANES, 8, 8):
+        raise ValueError(f"buffer of shape {out.shape} can't hold {n} positions of {(NUM_PLANES, 8, 8)}")
+    if n == 0:
+        return out[:0]
+
+    # Little-endian uint64 so byte k holds squares 8k..8k+7, i.e. board row k
+    bitboards = np.fromiter((bb for gs in gamestates for bb in gs.bitboards), dtype='<u8', count=n * PIECE_PLANES)
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder='little')
+    out[:n, :PIECE_PLANES] = bits.reshape(n, PIECE_PLANES, 8, 8)
+
+    flags = np.fromiter((flag for gs in gamestates for flag in (
+        gs.whiteToMove, gs.currentCastleRights.wks, gs.currentCastleRights.wqs,
+        gs.currentCastleRights.bks, gs.currentCastleRights.bqs)), dtype=np.uint8, count=n * 5)
+    out[:n, SIDE_PLANE:ENPASSANT_PLANE] = flags.reshape(n, 5, 1, 1)
+
+    out[:n, ENPASSANT_PLANE] = 0
+    for i, gs in enumerate(gamestates):
+        if gs.enpassantPossible != ():
+            out[i, ENPASSANT_PLANE, gs.enpassantPossible[0], gs.enpassantPossible[1]] = 1
+    return out[:n]
+
+
+def move_codes(moves):
+    # Packed 16-bit codes of a move list, what getValidMoveCodes returns directly
+    return np.fromiter((move.packed for move in moves), dtype=np.uint16, count=len(moves))
+
+
+def policy_indices(codes):
+    """
+    Policy slot of every packed move code. Takes a uint16 array or the
+    array('H') from getValidMoveCodes, which is read without copying.
+    """
+    return np.frombuffer(codes, dtype=np.uint16) & 0xFFF if not isinstance(codes, np.ndarray) else codes & 0xFFF
+
+
+def policy_index(move):
+    return move.packed & 0xFFF
+
+
+def encode_moves(codes, out=None):
+    """
+    Move.encodeMove for a whole array of packed codes at once:
+    rows of [start square, end square, en passant, promotion, castle].
+    """
+    codes = np.frombuffer(codes, dtype=np.uint16) if not isinstance(codes, np.ndarray) else codes
+    n = len(codes)
+    if out is None:
+        out = np.empty((n, 5), dtype=np.int64)
+    kinds = codes >> 14
+    out[:n, 0] = codes & 63
+    out[:n, 1] = (codes >> 6) & 63
+    out[:n, 2] = kinds == ChessEngine.MOVE_ENPASSANT
+    out[:n, 3] = kinds == ChessEngine.MOVE_PROMOTION
+    out[:n, 4] = kinds == ChessEngine.MOVE_CASTLE
+    return out[:n]
@@ -0,0 +1,85 @@
+import ChessEngine
+import numpy as np
+from Encoder import POLICY_SIZE, move_codes, policy_indices
+
+# encodeGamestate piece codes run from -6 (bK) to 6 (wK)
+PIECE_CODES = 13
+CODE_OFFSET = 6
+
+
+class Evaluator:
+    """
+    Scores a batch of search leaves with one call, so the per-call cost of a
+    model (or of NumPy itself) is paid once per batch instead of once per leaf.
+
+    evaluate() gets
+      boards:        (N, 8, 8) int8, GameState.encodeGamestate of each leaf
+      white_to_move: (N,) bool
+      legal_moves:   list of N move lists
+    and returns (priors, values): a list of N arrays of move probabilities
+    aligned with legal_moves, and an (N,) array of values in [-1, 1] for the
+    side to move at each leaf.
+    """
+    def evaluate(self, boards, white_to_move, legal_moves):
+        raise NotImplementedError
+
+
+class NumpyEvaluator(Evaluator):
+    """
+    CPU reference evaluator, a linear model in NumPy.
+
+    value  = tanh(sum of value_weights[piece code, square] / value_scale)
+             from white's side, negated for black to move
+    priors = softmax of policy_logits[Encoder.policy_index(move)] over the legal moves
+
+    The defaults are material from evaluation.json (kings count 0) and
+    uniform priors; trained weights can be loaded with from_file().
+    """
+    def __init__(self, value_weights=None, policy_logits=None, value_scale=1000.0):
+        if value_weights is None:
+            value_weights = np.zeros((PIECE_CODES, 64), dtype=np.float32)
+            # Same codes as encodeGamestate, kings (6) stay at 0
+            for code, piece in enumerate(('p', 'N', 'B', 'R', 'Q'), start=1):
+                value = ChessEngine.PIECE_VALUES.get(piece, 0)
+                value_weights[CODE_OFFSET + code] = value
+                value_weights[CODE_OFFSET - code] = -value
+        if policy_logits is None:
+            policy_logits = np.zeros(POLICY_SIZE, dtype=np.float32)
+        self.value_weights = np.asarray(value_weights, dtype=np.float32)
+        self.policy_logits = np.asarray(policy_logits, dtype=np.float32)
+        self.value_scale = value_scale
+
+    @classmethod
+    def from_file(cls, path):
+        # .npz with 'value_weights' (13, 64), 'policy_logits' (4096,) and optionally 'value_scale'
+        data = np.load(path)
+        scale = float(data['value_scale']) if 'value_scale' in data else 1000.0
+        return cls(data['value_weights'], data['policy_logits'], scale)
+
+    def save(self, path):
+        np.savez(path, value_weights=self.value_weights, policy_logits=self.policy_logits,
+                 value_scale=self.value_scale)
+
+    def evaluate(self, boards, white_to_move, legal_moves):
+        boards = np.asarray(boards).reshape(len(legal_moves), 64)
+        # One gather over the whole batch: weight of the piece on every square
+        raw = self.value_weights[boards + CODE_OFFSET, np.arange(64)].sum(axis=1)
+        values = np.tanh(raw / self.value_scale)
+        values = np.where(white_to_move, values, -values)
+
+        # Softmax per leaf over its own legal moves, done on one flat array
+        counts = np.array([len(moves) for moves in legal_moves])
+        indices = policy_indices(move_codes([move for moves in legal_moves for move in moves]))
+        logits = self.policy_logits[indices]
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        maxima = np.zeros(len(counts), dtype=np.float32)
+        if len(indices):
+            maxima[nonempty] = np.maximum.reduceat(logits, offsets[nonempty])
+        exps = np.exp(logits - np.repeat(maxima, counts))
+        sums = np.zeros(len(counts), dtype=np.float32)
+        if len(indices):
+            sums[nonempty] = np.add.reduceat(exps, offsets[nonempty])
+        probs = exps / np.repeat(np.where(sums > 0, sums, 1), counts)
+        priors = np.split(probs, np.cumsum(counts)[:-1])
+        return priors, values
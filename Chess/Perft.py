@@ -0,0 +1,127 @@
+import ChessEngine
+import argparse
+import json
+import sys
+import time
+
+# Reference node counts from https://www.chessprogramming.org/Perft_Results
+POSITIONS = {
+    'startpos': ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                 [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603]),
+    'position3': ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  [14, 191, 2812, 43238, 674624]),
+    'position4': ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 264, 9467, 422333]),
+    'position5': ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  [44, 1486, 62379, 2103487]),
+    'position6': ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  [46, 2079, 89890, 3894594]),
+}
+
+
+def load_fen(fen):
+    # Kept for callers of the old helper, GameState reads FEN itself now
+    return ChessEngine.GameState(fen)
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """
+    Returns {move notation: node count} for every root move, the usual way of
+    locating a move generator bug against a reference engine.
+    """
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+def run_position(name, fen, expected, max_depth, check_hash=False):
+    gs = load_fen(fen)
+    gs.debugZobrist = check_hash
+    gs.moveCache = None  # Perft sees each position about once, measure the generator itself
+    results = []
+    for depth in range(1, min(max_depth, len(expected)) + 1):
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'position': name,
+            'fen': fen,
+            'depth': depth,
+            'nodes': nodes,
+            'expected': expected[depth - 1],
+            'passed': nodes == expected[depth - 1],
+            'seconds': round(elapsed, 4),
+            'nps': round(nodes / elapsed) if elapsed > 0 else None,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generator throughput.")
+    parser.add_argument('--depth', type=int, default=3, help="maximum depth per position (default 3)")
+    parser.add_argument('--position', action='append', choices=sorted(POSITIONS),
+                        help="position to run, may be repeated (default: all)")
+    parser.add_argument('--fen', help="run a divide on this FEN instead of the reference suite")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--check-hash', action='store_true',
+                        help="verify the incremental Zobrist key against a full recompute after every move")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        gs = load_fen(args.fen)
+        gs.debugZobrist = args.check_hash
+        gs.moveCache = None
+        counts = divide(gs, args.depth)
+        for notation, nodes in sorted(counts.items()):
+            print(f"{notation}: {nodes}")
+        print(f"Total: {sum(counts.values())}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'fen': args.fen, 'depth': args.depth, 'divide': counts}, f, indent=2)
+        return 0
+
+    results = []
+    for name in args.position or list(POSITIONS):
+        fen, expected = POSITIONS[name]
+        for result in run_position(name, fen, expected, args.depth, args.check_hash):
+            status = 'ok' if result['passed'] else f"FAIL (expected {result['expected']})"
+            print(f"{name:<10} depth {result['depth']}: {result['nodes']:>9} nodes "
+                  f"{result['seconds']:>8.3f}s {result['nps'] or 0:>8} nps  {status}")
+            results.append(result)
+
+    total_nodes = sum(r['nodes'] for r in results)
+    total_seconds = sum(r['seconds'] for r in results)
+    summary = {
+        'nodes': total_nodes,
+        'seconds': round(total_seconds, 4),
+        'nps': round(total_nodes / total_seconds) if total_seconds > 0 else None,
+        'passed': all(r['passed'] for r in results),
+    }
+    print(f"Total: {total_nodes} nodes in {total_seconds:.3f}s ({summary['nps']} nps)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=2)
+    return 0 if summary['passed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class SearchStopped(Exception):
+    """
+    Raised inside a depth-first search when its SearchLimits run out, so the
+    recursion unwinds at once. The caller keeps the last complete result.
+    """
+
+
+class SearchLimits:
+    """
+    Budget shared by ChessAI.search and MCTS.search: any combination of a
+    time limit (movetime in seconds, or an absolute time.monotonic deadline),
+    a node limit, a depth limit and a stop signal another thread can set.
+    A node is one negamax call for alpha-beta and one playout for MCTS.
+    With no limits at all the search runs to its own fixed depth/playouts.
+    """
+    def __init__(self, movetime=None, deadline=None, nodes=None, depth=None, stop_event=None):
+        self.start = time.monotonic()
+        if deadline is None and movetime is not None:
+            deadline = self.start + movetime
+        self.deadline = deadline
+        self.max_nodes = nodes
+        self.max_depth = depth
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.nodes = 0
+        self.stopped_by = None  # 'time', 'nodes' or 'stop' once a limit was hit
+
+    def stop(self):
+        # Safe to call from any thread, the search notices on its next node
+        self.stop_event.set()
+
+    def tick(self):
+        """
+        Counts one node. Returns True instead, without counting it, once a
+        limit is hit; from then on every call returns True.
+        """
+        if self.stopped_by is not None:
+            return True
+        if self.stop_event.is_set():
+            self.stopped_by = 'stop'
+        elif self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.stopped_by = 'nodes'
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stopped_by = 'time'
+        else:
+            self.nodes += 1
+            return False
+        return True
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def for_worker(self):
+        # Copy for another process: same deadline and node budget, but a stop
+        # signal can't cross the process boundary so the worker gets its own
+        return SearchLimits(deadline=self.deadline, nodes=self.max_nodes, depth=self.max_depth)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['stop_event'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stop_event = threading.Event()
+
+
+class SearchResult:
+    """
+    What a limited search returns: the best move found so far (None when
+    there is no legal move), its score if the search has one, and the work
+    actually done.
+    """
+    def __init__(self, best_move, score=None, pv=None, depth=0, nodes=0, seconds=0.0, stopped_by=None, info=None):
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv if pv is not None else ([best_move] if best_move is not None else [])
+        self.depth = depth  # Completed iterative deepening iterations, 0 for MCTS
+        self.nodes = nodes
+        self.seconds = seconds
+        self.stopped_by = stopped_by  # None when the search finished on its own
+        self.info = info if info is not None else {}
+
+    def nps(self):
+        return round(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def __repr__(self):
+        move = self.best_move.getChessNotation() if self.best_move is not None else None
+        return (f"SearchResult(best_move={move}, score={self.score}, depth={self.depth}, nodes={self.nodes}, "
+                f"seconds={self.seconds:.3f}, stopped_by={self.stopped_by})")
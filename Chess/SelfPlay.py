@@ -0,0 +1,244 @@
+import AlphaShrimp
+import ChessEngine
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+from Encoder import POLICY_SIZE, move_codes, policy_indices
+
+# One shard is a set of .npy files with the same number of rows:
+#   boards   (shard_size, 8, 8) int8     GameState.encodeGamestate
+#   white    (shard_size,) bool          white to move
+#   policies (shard_size, POLICY_SIZE) float16, root visit distribution on Encoder.policy_index slots
+#   values   (shard_size,) int8          game result for the side to move: 1 win, 0 draw, -1 loss
+# The last shard may be partly filled, index.json says how many rows count.
+ARRAYS = {
+    'boards': ((8, 8), np.int8),
+    'white': ((), np.bool_),
+    'policies': ((POLICY_SIZE,), np.float16),
+    'values': ((), np.int8),
+}
+INDEX_FILE = 'index.json'
+
+
+def play_game(args, seed, max_plies=200, temperature_plies=10):
+    """
+    One AlphaShrimp-vs-AlphaShrimp game from the default GameState. Both sides
+    share a PersistentMCTS, so each search starts from the previous tree. For
+    the first temperature_plies plies the move is drawn from the visit
+    distribution, afterwards the most visited move is played. Returns the
+    samples as (boards, white, policy slots, policy probs, values), policies
+    kept sparse to keep the result small to send back, and the result.
+    """
+    np.random.seed(seed)
+    gs = ChessEngine.GameState()
+    mcts = AlphaShrimp.PersistentMCTS(gs, args)
+    boards, white, slots, probs = [], [], [], []
+    result = 'draw'
+    for ply in range(max_plies):
+        value, terminated = gs.getValueAndTerminated()
+        if terminated:
+            result = 'checkmate' if value else 'stalemate'
+            break
+        possible_actions, action_probs = mcts.search()
+        boards.append(gs.encodeGamestate())
+        white.append(gs.whiteToMove)
+        slots.append(policy_indices(move_codes(possible_actions)))
+        probs.append(np.asarray(action_probs, dtype=np.float32))
+        if ply < temperature_plies:
+            move = possible_actions[np.random.choice(len(possible_actions), p=action_probs)]
+        else:
+            move = possible_actions[int(np.argmax(action_probs))]
+        gs.makeMove(move)
+    mcts.reset()
+
+    white = np.array(white, dtype=np.bool_)
+    values = np.zeros(len(white), dtype=np.int8)
+    if result == 'checkmate':
+        # The side to move at the end is mated
+        values[:] = np.where(white == gs.whiteToMove, -1, 1)
+    samples = (np.array(boards, dtype=np.int8).reshape(-1, 8, 8), white, slots, probs, values)
+    return samples, {'seed': seed, 'plies': len(white), 'result': result,
+                     'winner': None if result != 'checkmate' else ('black' if gs.whiteToMove else 'white')}
+
+
+def _play_worker(job):
+    # Runs in a pool process
+    args, seed, max_plies, temperature_plies = job
+    start = time.perf_counter()
+    samples, report = play_game(args, seed, max_plies, temperature_plies)
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return samples, report
+
+
+class ShardWriter:
+    """
+    Appends samples to fixed-size memory-mapped shards under `directory`.
+    Only the current shard is open, so memory use doesn't grow with the
+    dataset. close() (or leaving the with block) writes index.json.
+    """
+    def __init__(self, directory, shard_size=16384):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards = []  # {'name', 'rows'} of every shard so far
+        self.current = None  # name -> open memmap of the shard being filled
+        self.rows = 0  # Rows used in the current shard
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_shard(self):
+        name = f"shard_{len(self.shards):05d}"
+        self.current = {
+            array: np.lib.format.open_memmap(os.path.join(self.directory, f"{name}.{array}.npy"), mode='w+',
+                                             dtype=dtype, shape=(self.shard_size,) + shape)
+            for array, (shape, dtype) in ARRAYS.items()
+        }
+        self.shards.append({'name': name, 'rows': 0})
+        self.rows = 0
+
+    def _flush_shard(self):
+        for memmap in self.current.values():
+            memmap.flush()
+        self.shards[-1]['rows'] = self.rows
+        self.current = None
+
+    def write(self, boards, white, slots, probs, values):
+        # One game's samples, policies given sparse as per-ply slot and probability arrays
+        done = 0
+        while done < len(values):
+            if self.current is None:
+                self._open_shard()
+            count = min(len(values) - done, self.shard_size - self.rows)
+            rows = slice(self.rows, self.rows + count)
+            self.current['boards'][rows] = boards[done:done + count]
+            self.current['white'][rows] = white[done:done + count]
+            self.current['values'][rows] = values[done:done + count]
+            policies = self.current['policies']
+            policies[rows] = 0
+            for i in range(count):
+                # add.at, not assignment: the four promotion choices share one from/to slot
+                np.add.at(policies[self.rows + i], slots[done + i], probs[done + i])
+            self.rows += count
+            done += count
+            if self.rows == self.shard_size:
+                self._flush_shard()
+
+    def close(self):
+        if self.current is not None:
+            self._flush_shard()
+        index = {
+            'shard_size': self.shard_size,
+            'samples': sum(shard['rows'] for shard in self.shards),
+            'arrays': {array: {'shape': list(shape), 'dtype': np.dtype(dtype).str} for array, (shape, dtype) in ARRAYS.items()},
+            'shards': self.shards,
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=2)
+
+
+class ShardedDataset:
+    """
+    Read side of ShardWriter. Shards are opened as read-only memmaps, so
+    indexing or batching only pages in the rows actually touched.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.shards = [shard for shard in self.index['shards'] if shard['rows'] > 0]
+        self.offsets = np.cumsum([0] + [shard['rows'] for shard in self.shards])
+        self._open = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, i):
+        # Arrays of shard i, trimmed to its used rows
+        if i not in self._open:
+            name, rows = self.shards[i]['name'], self.shards[i]['rows']
+            self._open[i] = {array: np.load(os.path.join(self.directory, f"{name}.{array}.npy"), mmap_mode='r')[:rows]
+                             for array in ARRAYS}
+        return self._open[i]
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        arrays = self.shard(shard)
+        row = i - self.offsets[shard]
+        return tuple(arrays[array][row] for array in ARRAYS)
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        """
+        Yields (boards, white, policies, values) batches. Batches never span
+        two shards; with shuffle the shard order and the rows inside each
+        shard are permuted, which keeps reads local to one file at a time.
+        """
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(self.shards)) if shuffle else range(len(self.shards))
+        for i in order:
+            arrays = self.shard(int(i))
+            rows = len(arrays['values'])
+            positions = rng.permutation(rows) if shuffle else np.arange(rows)
+            for start in range(0, rows, batch_size):
+                take = np.sort(positions[start:start + batch_size])
+                yield tuple(np.asarray(arrays[array][take]) for array in ARRAYS)
+
+
+def generate(directory, games, args, workers=1, shard_size=16384, max_plies=200, temperature_plies=10, seed=0):
+    """
+    Plays `games` self-play games over `workers` processes and streams their
+    samples into shards under `directory` as games finish. Game i uses seed
+    seed + i. Returns the per-game reports.
+    """
+    jobs = [(args, seed + i, max_plies, temperature_plies) for i in range(games)]
+    reports = []
+    with ShardWriter(directory, shard_size) as writer:
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                for samples, report in pool.imap_unordered(_play_worker, jobs):
+                    writer.write(*samples)
+                    reports.append(report)
+                    print(json.dumps(report), flush=True)
+        else:
+            for job in jobs:
+                samples, report = _play_worker(job)
+                writer.write(*samples)
+                reports.append(report)
+                print(json.dumps(report), flush=True)
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless AlphaShrimp self-play, written as sharded .npy training data.")
+    parser.add_argument('output', help="directory for the shards and index.json")
+    parser.add_argument('--games', type=int, default=10, help="games to play (default 10)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes (default: one per CPU)")
+    parser.add_argument('--searches', type=int, default=200, help="MCTS playouts per move (default 200)")
+    parser.add_argument('--C', type=float, default=1.4, help="UCB exploration constant (default 1.4)")
+    parser.add_argument('--shard-size', type=int, default=16384, help="samples per shard (default 16384)")
+    parser.add_argument('--max-plies', type=int, default=200, help="plies before a game is scored a draw (default 200)")
+    parser.add_argument('--temperature-plies', type=int, default=10,
+                        help="opening plies whose move is sampled from the visit counts (default 10)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (default 0)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    reports = generate(args.output, args.games, {'C': args.C, 'num_searches': args.searches}, args.workers,
+                       args.shard_size, args.max_plies, args.temperature_plies, args.seed)
+    seconds = time.perf_counter() - start
+    samples = sum(report['plies'] for report in reports)
+    print(f"{len(reports)} games, {samples} samples in {seconds:.1f}s -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
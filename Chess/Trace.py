@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import time
+
+# Levels, same numbers as the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100
+LEVEL_NAMES = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'off': OFF}
+
+
+class TextSink:
+    """
+    Writes one readable line per event, e.g. `[movegen] castle_kingside row=7 col=4`.
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, category, level, event, fields):
+        details = ' '.join(f"{name}={value}" for name, value in fields.items())
+        print(f"[{category}] {event} {details}".rstrip(), file=self.stream or sys.stdout)
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+    Appends one JSON object per event to a file, for offline analysis.
+    Values that aren't JSON types (moves, boards) are written with str().
+    """
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def write(self, category, level, event, fields):
+        record = {'time': time.time(), 'category': category, 'level': level, 'event': event}
+        record.update(fields)
+        self.file.write(json.dumps(record, default=str) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Category:
+    """
+    A named event category. The debug/info/warning flags are plain attributes
+    so a call site costs one attribute read when tracing is off:
+
+        if TRACE.debug:
+            TRACE.event(Trace.DEBUG, 'pawn_check', row=r, col=c)
+    """
+    __slots__ = ('name', 'level', 'debug', 'info', 'warning')
+
+    def __init__(self, name):
+        self.name = name
+        self.setLevel(OFF)
+
+    def setLevel(self, level):
+        self.level = level
+        self.debug = level <= DEBUG
+        self.info = level <= INFO
+        self.warning = level <= WARNING
+
+    def event(self, level, event, **fields):
+        if level >= self.level:
+            _sink.write(self.name, level, event, fields)
+
+
+_categories = {}
+_levels = {}  # Last configured levels, applied to categories created afterwards too
+_sink = TextSink()
+
+
+def _parseLevel(level):
+    return LEVEL_NAMES[level] if isinstance(level, str) else level
+
+
+def category(name):
+    # Modules grab their category once at import time and keep it
+    if name not in _categories:
+        cat = Category(name)
+        level = _levels.get(name, _levels.get('*'))
+        if level is not None:
+            cat.setLevel(level)
+        _categories[name] = cat
+    return _categories[name]
+
+
+def configure(levels=None, sink=None):
+    """
+    levels maps category names to a level (int or 'debug'/'info'/...), '*'
+    sets every category. sink replaces the current sink, the old one is closed.
+    """
+    global _sink
+    if sink is not None:
+        _sink.close()
+        _sink = sink
+    for name, level in (levels or {}).items():
+        _levels[name] = _parseLevel(level)
+    for name, cat in _categories.items():
+        level = _levels.get(name, _levels.get('*'))
+        if level is not None:
+            cat.setLevel(level)
+
+
+def configureFromEnvironment():
+    """
+    STOCKSHRIMP_TRACE="movegen=debug,mcts=info" (or "*=debug") turns categories
+    on, STOCKSHRIMP_TRACE_FILE=path.jsonl sends events to a JSON lines file.
+    Everything is off by default.
+    """
+    spec = os.environ.get('STOCKSHRIMP_TRACE', '')
+    path = os.environ.get('STOCKSHRIMP_TRACE_FILE')
+    levels = {}
+    for item in filter(None, spec.split(',')):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().lower() or 'debug'
+    configure(levels, JsonLinesSink(path) if path else None)
+
+
+# Categories used across the engine, created here so configure() sees all of them
+MOVEGEN = category('movegen')
+MAKEMOVE = category('makemove')
+SEARCH = category('search')
+MCTS = category('mcts')
+
+configureFromEnvironment()
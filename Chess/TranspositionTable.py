@@ -0,0 +1,94 @@
+import numpy as np
+
+# Bound types
+EXACT = 0
+LOWER_BOUND = 1  # Score is at least this (fail high / beta cutoff)
+UPPER_BOUND = 2  # Score is at most this (fail low)
+
+NO_MOVE = -1
+
+# Bytes per slot: key (8) + score (4) + move (4) + depth (1) + bound (1) + age (1)
+SLOT_BYTES = 19
+SLOTS_PER_BUCKET = 2  # 0: depth-preferred, 1: always-replace
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of search results keyed by GameState.zobristKey.
+
+    Every bucket has two slots. The first keeps the deepest result seen for
+    the bucket (or anything from an older search), the second always takes
+    the newest store, so shallow recent results don't evict expensive deep ones.
+    """
+
+    def __init__(self, size_mb=16):
+        buckets = max(1, (size_mb * 1024 * 1024) // (SLOT_BYTES * SLOTS_PER_BUCKET))
+        # Round down to a power of two so the bucket index is a mask
+        self.num_buckets = 1 << (buckets.bit_length() - 1)
+        self.mask = self.num_buckets - 1
+        slots = self.num_buckets * SLOTS_PER_BUCKET
+        self.keys = np.zeros(slots, dtype=np.uint64)
+        self.scores = np.zeros(slots, dtype=np.int32)
+        self.moves = np.full(slots, NO_MOVE, dtype=np.int32)
+        self.depths = np.full(slots, -1, dtype=np.int8)
+        self.bounds = np.zeros(slots, dtype=np.int8)
+        self.ages = np.zeros(slots, dtype=np.uint8)
+        self.age = 0
+        self.score_kind = None  # What the stored scores mean, set by the first search that uses the table
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        # Entries from earlier searches become fair game for the depth-preferred slot
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.keys.fill(0)
+        self.moves.fill(NO_MOVE)
+        self.depths.fill(-1)
+        self.age = 0
+        self.score_kind = None
+        self.probes = self.hits = self.stores = 0
+
+    def probe(self, key):
+        """
+        Returns (depth, score, bound, move) for `key`, or None on a miss.
+        """
+        self.probes += 1
+        slot = (key & self.mask) * SLOTS_PER_BUCKET
+        for i in (slot, slot + 1):
+            if self.depths[i] >= 0 and int(self.keys[i]) == key:
+                self.hits += 1
+                return int(self.depths[i]), int(self.scores[i]), int(self.bounds[i]), int(self.moves[i])
+        return None
+
+    def store(self, key, depth, score, bound, move=NO_MOVE):
+        self.stores += 1
+        slot = (key & self.mask) * SLOTS_PER_BUCKET
+        if not (int(self.keys[slot]) == key or depth >= self.depths[slot] or self.ages[slot] != self.age):
+            slot += 1  # Depth-preferred slot holds something deeper, use the always-replace slot
+        if move == NO_MOVE and int(self.keys[slot]) == key:
+            move = int(self.moves[slot])  # Keep the old best move rather than losing it
+        self.keys[slot] = key
+        self.depths[slot] = min(depth, 127)
+        self.scores[slot] = score
+        self.bounds[slot] = bound
+        self.moves[slot] = move
+        self.ages[slot] = self.age
+
+    def hashfull(self):
+        """
+        Permille of slots in use, sampled from the first 1000 slots like UCI engines report it.
+        """
+        sample = self.depths[:1000]
+        return int(np.count_nonzero(sample >= 0) * 1000 // len(sample))
+
+    def stats(self):
+        return {
+            'size_mb': round(self.num_buckets * SLOTS_PER_BUCKET * SLOT_BYTES / (1024 * 1024), 2),
+            'probes': self.probes,
+            'hits': self.hits,
+            'stores': self.stores,
+            'hashfull': self.hashfull(),
+        }
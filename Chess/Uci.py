@@ -0,0 +1,293 @@
+import AlphaShrimp
+import ChessAI
+import ChessEngine
+import asyncio
+import copy
+import sys
+import threading
+import time
+from Search import SearchLimits
+from TranspositionTable import TranspositionTable
+
+ENGINE_NAME = "StockShrimp"
+ENGINE_AUTHOR = "MGProenca"
+ENGINES = ('alphabeta', 'mcts')
+DEFAULT_MOVES_TO_GO = 30  # Moves the remaining clock is split over when the GUI doesn't say
+MCTS_INFO_EVERY = 200  # Playouts between MCTS info lines
+
+
+def packed_to_uci(packed):
+    # Long algebraic with the promotion piece always spelled out, e.g. e7e8q
+    start, end, kind = packed & 63, (packed >> 6) & 63, packed >> 14
+    move = ChessEngine.Move
+    notation = ''.join(move.colsToFiles[sq & 7] + move.rowsToRanks[sq >> 3] for sq in (start, end))
+    if kind == ChessEngine.MOVE_PROMOTION:
+        notation += ChessEngine.PROMOTION_CHOICES[(packed >> 12) & 3].lower()
+    return notation
+
+
+def uci_move(move):
+    return packed_to_uci(move.packed)
+
+
+def uci_score(score):
+    # ChessAI scores are centipawns for the side to move, mates count plies from the root
+    if abs(score) > ChessAI.MATE_BOUND:
+        moves = (ChessAI.MATE_SCORE - abs(score) + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {score}"
+
+
+def allocate_time(time_left, increment=0.0, moves_to_go=None, overhead=0.05):
+    # Seconds for this move: an even share of the clock plus most of the increment, never over half the clock
+    budget = time_left / (moves_to_go or DEFAULT_MOVES_TO_GO) + increment * 0.75
+    return max(0.01, min(budget, time_left * 0.5) - overhead)
+
+
+class UciEngine:
+    """
+    UCI protocol state. handle() takes one command line at a time and never
+    blocks on a search: go starts one on a worker thread, which sends the info
+    lines and finally bestmove itself. stop and ponderhit only change the
+    running search's SearchLimits, which the search reads on its next node.
+    In infinite and ponder mode the bestmove is held back until stop or
+    ponderhit, as the protocol asks, even if the search ended on its own.
+    """
+    def __init__(self, out=None):
+        self.out = out if out is not None else sys.stdout
+        self.out_lock = threading.Lock()
+        self.options = {'Hash': ChessAI.TT_SIZE_MB, 'Engine': 'alphabeta', 'Ponder': False,
+                        'MoveOverhead': 50, 'MCTS_C': 1.4}
+        self.gs = ChessEngine.GameState(ChessEngine.START_FEN)
+        self.tt = None
+        self.mcts = None
+        self.thread = None
+        self.limits = None
+        self.held = threading.Event()  # Cleared while bestmove must wait for stop/ponderhit
+        self.held.set()
+        self.ponder_movetime = None  # Budget to apply on ponderhit, None for no time limit
+
+    def send(self, line):
+        with self.out_lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def handle(self, line):
+        # Returns False once the GUI sent quit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {ChessAI.TT_SIZE_MB} min 1 max 1024")
+            self.send(f"option name Engine type combo default alphabeta {' '.join('var ' + e for e in ENGINES)}")
+            self.send("option name Ponder type check default false")
+            self.send("option name MoveOverhead type spin default 50 min 0 max 5000")
+            self.send("option name MCTS_C type string default 1.4")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.set_option(args)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.tt = None
+            self.mcts = None
+            self.gs = ChessEngine.GameState(ChessEngine.START_FEN)
+        elif command == 'position':
+            self.stop()
+            self.set_position(args)
+        elif command == 'go':
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'd':
+            self.send(f"info string fen {self.gs.getFen()}")
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, args):
+        # setoption name <id> [value <x>], the name may contain spaces
+        if 'name' not in args:
+            return
+        split = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:split])
+        value = ' '.join(args[split + 1:])
+        try:
+            if name == 'Hash':
+                self.options['Hash'] = max(1, int(value))
+                self.tt = None
+            elif name == 'Engine' and value in ENGINES:
+                self.options['Engine'] = value
+            elif name == 'Ponder':
+                self.options['Ponder'] = value == 'true'
+            elif name == 'MoveOverhead':
+                self.options['MoveOverhead'] = max(0, int(value))
+            elif name == 'MCTS_C':
+                self.options['MCTS_C'] = float(value)
+                self.mcts = None
+            else:
+                self.send(f"info string unknown option {name}")
+        except ValueError:
+            self.send(f"info string bad value {value} for {name}")
+
+    def set_position(self, args):
+        # position startpos | fen <fen> [moves <m1> ...]
+        moves = args.index('moves') if 'moves' in args else len(args)
+        try:
+            if args[:1] == ['startpos']:
+                gs = ChessEngine.GameState(ChessEngine.START_FEN)
+            elif args[:1] == ['fen']:
+                gs = ChessEngine.GameState(' '.join(args[1:moves]))
+            else:
+                raise ValueError(f"invalid position: {' '.join(args)}")
+        except ValueError as e:
+            self.send(f"info string {e}")
+            return
+        for notation in args[moves + 1:]:
+            move = next((move for move in gs.getValidMoves() if uci_move(move) == notation), None)
+            if move is None:
+                self.send(f"info string illegal move {notation}")
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, args):
+        self.stop()
+        params = {}
+        flags = set()
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                flags.add(args[i])
+                i += 1
+            elif args[i] == 'searchmoves':
+                break  # Not supported, and it swallows the rest of the line
+            else:
+                if i + 1 < len(args):
+                    params[args[i]] = args[i + 1]
+                i += 2
+
+        try:
+            movetime = float(params['movetime']) / 1000 if 'movetime' in params else None
+            clock = 'wtime' if self.gs.whiteToMove else 'btime'
+            if movetime is None and clock in params:
+                increment = float(params.get('winc' if self.gs.whiteToMove else 'binc', 0)) / 1000
+                moves_to_go = int(params['movestogo']) if 'movestogo' in params else None
+                movetime = allocate_time(float(params[clock]) / 1000, increment, moves_to_go,
+                                         self.options['MoveOverhead'] / 1000)
+            nodes = int(params['nodes']) if 'nodes' in params else None
+            depth = int(params['depth']) if 'depth' in params else None
+        except ValueError:
+            self.send(f"info string bad go command: go {' '.join(args)}")
+            return
+
+        if 'infinite' in flags or 'ponder' in flags:
+            # No clock while pondering, the budget starts at ponderhit
+            self.ponder_movetime = movetime if 'ponder' in flags else None
+            self.limits = SearchLimits(nodes=nodes, depth=depth)
+            self.held.clear()
+        else:
+            self.limits = SearchLimits(movetime=movetime, nodes=nodes, depth=depth)
+            self.held.set()
+        self.thread = threading.Thread(target=self._run, args=(copy.deepcopy(self.gs), self.limits), daemon=True)
+        self.thread.start()
+
+    def ponderhit(self):
+        # The expected move was played: the ponder search becomes the real one
+        if self.limits is None or self.held.is_set():
+            return
+        if self.ponder_movetime is not None:
+            self.limits.deadline = time.monotonic() + self.ponder_movetime
+        self.held.set()
+
+    def stop(self):
+        # Ends any running search; its thread sends bestmove before we return
+        if self.thread is None:
+            return
+        self.limits.stop()
+        self.held.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self, gs, limits):
+        if self.options['Engine'] == 'mcts':
+            result = self._search_mcts(gs, limits)
+        else:
+            if self.tt is None:
+                self.tt = TranspositionTable(self.options['Hash'])
+            result = ChessAI.search(gs, limits, self.tt, self._send_iteration)
+        self.held.wait()
+        if result.best_move is None:
+            self.send("bestmove 0000")
+            return
+        if result.stopped_by is not None or result.depth == 0:
+            self._send_info(result)  # Completed iterations were already reported
+        line = f"bestmove {uci_move(result.best_move)}"
+        if len(result.pv) > 1:
+            line += f" ponder {uci_move(result.pv[1])}"
+        self.send(line)
+
+    def _search_mcts(self, gs, limits):
+        # A PersistentMCTS keeps its tree across go commands of the same game
+        if self.mcts is None:
+            self.mcts = AlphaShrimp.PersistentMCTS(gs, {'C': self.options['MCTS_C']})
+            self.mcts.on_progress = self._send_mcts_progress
+            self.mcts.progress_every = MCTS_INFO_EVERY
+        self.mcts.gamestate = gs
+        return self.mcts.search_limited(limits)
+
+    def _send_iteration(self, result):
+        self._send_info(result)
+
+    def _send_info(self, result):
+        seconds = max(result.seconds, 1e-6)
+        fields = [f"depth {result.depth}"] if result.depth else []
+        if result.score is not None:
+            fields.append(f"score {uci_score(result.score)}")
+        fields.append(f"nodes {result.nodes} nps {round(result.nodes / seconds)} time {round(result.seconds * 1000)}")
+        if result.pv:
+            fields.append("pv " + ' '.join(uci_move(move) for move in result.pv))
+        self.send("info " + ' '.join(fields))
+
+    def _send_mcts_progress(self, mcts):
+        children = mcts.root_children() if mcts.root is not None else []
+        if not children:
+            return
+        packed = max(children, key=lambda child: child[1])[0]
+        seconds = max(mcts.limits.elapsed(), 1e-6)
+        self.send(f"info nodes {mcts.searches_done} nps {round(mcts.searches_done / seconds)} "
+                  f"time {round(seconds * 1000)} pv {packed_to_uci(packed)}")
+
+
+async def run(engine=None, stream=None):
+    """
+    Reads UCI commands from `stream` (stdin) on the asyncio loop. The blocking
+    readline runs in the default executor, so the loop stays free while a
+    search thread works and stop/ponderhit are handled as soon as they arrive.
+    """
+    engine = engine if engine is not None else UciEngine()
+    stream = stream if stream is not None else sys.stdin
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, stream.readline)
+        if not line:  # EOF, the GUI went away
+            engine.stop()
+            break
+        if not engine.handle(line):
+            break
+
+
+def main():
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())